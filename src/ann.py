@@ -0,0 +1,220 @@
+import os
+import json
+import logging
+import argparse
+
+import numpy as np
+
+import store
+from cluster import kmeans, nearest_centroid
+from quantize import QUANTIZERS
+from registry import TrackKeyIndex
+from similarity import SimilarityEngine, METRICS, MATRIX_PATH, KEY_TABLE
+
+
+OUTPUT_DIR = "Path"
+INDEX_DIR = os.path.join(OUTPUT_DIR, "lowlevel_ivf")
+
+# Inverted lists; None picks 4·√n, which keeps lists around √n/4 tracks long.
+N_LISTS = None
+# Lists scanned per query, the recall/latency knob: more lists, more candidates, higher recall.
+NPROBE = 8
+# Optional compressed storage for indexed vectors: None (float32), "int8" or "pq".
+QUANTIZATION = None
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+class IVFIndex:
+    # Inverted-file index: tracks are clustered around n_lists centroids and stored list by
+    # list, so a list is one contiguous slice of vectors.npy. A query ranks the centroids and
+    # scans only the nprobe closest lists. Every array is memory-mapped on load.
+    #
+    # Quantized indexes store codes.npy instead: each track's residual from its list's
+    # centroid, encoded. Residuals span a much smaller range than the vectors themselves, so
+    # the same code size loses far less precision.
+
+    def __init__(self, metric, centroids, offsets, keys, vectors, quantizer=None):
+        self.metric = metric
+        self.centroids = centroids
+        self.offsets = offsets
+        self.keys = keys
+        # float32 vectors, or the quantizer's codes for their residuals.
+        self.vectors = vectors
+        self.quantizer = quantizer
+        if metric == "euclidean":
+            self.centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+            if quantizer is None:
+                self.sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        # Dense key → position lookup, as in FeatureMatrix.
+        self.position_of_key = np.full(int(keys.max()) + 1 if len(keys) else 0, -1, dtype=np.int64)
+        self.position_of_key[keys] = np.arange(len(keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def nbytes(self):
+        # Memory taken by the stored vectors or codes, the part that grows with the catalogue.
+        return self.vectors.nbytes
+
+    @classmethod
+    def build(cls, engine, n_lists=N_LISTS, quantization=QUANTIZATION):
+        # Clusters the engine's standardized vectors, so distances match SimilarityEngine exactly.
+        vectors = engine.vectors
+        n_lists = n_lists or max(1, int(4 * np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+
+        centroids = kmeans(vectors, n_lists, engine.metric)
+        assignment = nearest_centroid(vectors, centroids, engine.metric)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+
+        sizes = np.diff(offsets)
+        logging.info("IVF: %d tracks in %d lists, sizes min %d / median %d / max %d",
+                     len(vectors), n_lists, sizes.min(), np.median(sizes), sizes.max())
+
+        stored, quantizer = np.ascontiguousarray(vectors[order]), None
+        if quantization:
+            residuals = stored - centroids[assignment[order]]
+            quantizer = QUANTIZERS[quantization].train(residuals, engine.metric)
+            stored = quantizer.encode(residuals)
+            logging.info("IVF: %s codes, %d bytes per track instead of %d",
+                         quantization, quantizer.code_size, vectors.shape[1] * 4)
+        return cls(engine.metric, centroids, offsets, engine.matrix.keys[order].astype(np.int32), stored, quantizer)
+
+    def save(self, path):
+        with store.replacing_dir(path) as tmp:
+            for name in ("centroids", "offsets", "keys"):
+                np.save(os.path.join(tmp, name + ".npy"), getattr(self, name))
+            np.save(os.path.join(tmp, "codes.npy" if self.quantizer else "vectors.npy"), self.vectors)
+            if self.quantizer:
+                self.quantizer.save(tmp)
+            with open(os.path.join(tmp, "index.json"), "w", encoding="utf-8") as f:
+                json.dump({"metric": self.metric, "n_lists": self.n_lists, "dims": self.centroids.shape[1],
+                           "quantization": self.quantizer.name if self.quantizer else None}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                  for name in ("centroids", "offsets", "keys")}
+        quantization = meta.get("quantization")
+        if quantization:
+            quantizer = QUANTIZERS[quantization].load(path, meta["metric"], meta["dims"])
+            vectors = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+        else:
+            quantizer, vectors = None, np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        return cls(meta["metric"], vectors=vectors, quantizer=quantizer, **arrays)
+
+    def indexed(self, keys):
+        # Whether each int track key has a stored vector; tracks added after the build don't.
+        keys = np.asarray(keys, dtype=np.int64)
+        known = (keys >= 0) & (keys < len(self.position_of_key))
+        return known & (self.position_of_key[np.where(known, keys, 0)] >= 0)
+
+    def positions(self, keys):
+        # Stored positions for int track keys; raises KeyError for keys not in the index.
+        keys = np.asarray(keys, dtype=np.int64)
+        indexed = self.indexed(keys)
+        if not indexed.all():
+            raise KeyError(f"Keys not in the index: {keys[~indexed][:5].tolist()}")
+        return self.position_of_key[keys]
+
+    def vector(self, position):
+        # The stored vector at position, decoded (and so approximate) when quantized.
+        if self.quantizer is None:
+            return np.asarray(self.vectors[position])
+        i = np.searchsorted(self.offsets, position, side="right") - 1
+        return self.centroids[i] + self.quantizer.decode(self.vectors[position:position + 1])[0]
+
+    def _quantized_distances(self, query, prepared, i):
+        # Distances to list i from its residual codes. For cosine, q·(c + r) = q·c + q·r, so one
+        # prepared query serves every list; Euclidean needs the query's residual per list.
+        codes = self.vectors[self.offsets[i]:self.offsets[i + 1]]
+        if self.metric == "cosine":
+            return self.quantizer.distances(prepared, codes) - query @ self.centroids[i]
+        return self.quantizer.distances(self.quantizer.prepare(query - self.centroids[i]), codes)
+
+    def _distances(self, query, start, stop):
+        products = self.vectors[start:stop] @ query
+        if self.metric == "cosine":
+            return 1.0 - products
+        squared = self.sq_norms[start:stop] + query @ query - 2.0 * products
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def search_vector(self, query, k=10, nprobe=NPROBE, exclude=-1):
+        # Top-k (keys, distances) for a query vector, scanning the nprobe closest lists.
+        products = self.centroids @ query
+        scores = products if self.metric == "cosine" else 2.0 * products - self.centroid_norms
+        nprobe = min(nprobe, self.n_lists)
+        lists = np.argpartition(-scores, nprobe - 1)[:nprobe] if nprobe < self.n_lists else np.arange(self.n_lists)
+
+        positions = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+        if self.quantizer is None:
+            distances = np.concatenate([self._distances(query, self.offsets[i], self.offsets[i + 1]) for i in lists])
+        else:
+            prepared = self.quantizer.prepare(query) if self.metric == "cosine" else None
+            distances = np.concatenate([self._quantized_distances(query, prepared, i) for i in lists])
+        keep = positions != exclude
+        positions, distances = positions[keep], distances[keep]
+
+        k = min(k, len(positions))
+        top = np.argpartition(distances, k - 1)[:k] if k < len(positions) else np.arange(len(positions))
+        top = top[np.argsort(distances[top], kind="stable")]
+        return self.keys[positions[top]], distances[top].astype(np.float32)
+
+    def search(self, keys, k=10, nprobe=NPROBE):
+        # Top-k neighbor keys and distances for each seed key, nearest first, seeds excluded.
+        # Rows hold fewer than k results, padded with key -1, if the probed lists run short.
+        neighbors = np.full((len(keys), k), -1, dtype=np.int32)
+        distances = np.full((len(keys), k), np.inf, dtype=np.float32)
+        for i, position in enumerate(self.positions(keys)):
+            found, d = self.search_vector(self.vector(position), k, nprobe, exclude=position)
+            neighbors[i, :len(found)] = found
+            distances[i, :len(found)] = d
+        return neighbors, distances
+
+
+def build_index(matrix_path=MATRIX_PATH, key_table=KEY_TABLE, index_dir=INDEX_DIR, metric="cosine",
+                n_lists=N_LISTS, quantization=QUANTIZATION):
+    engine = SimilarityEngine.load(matrix_path, key_table, metric)
+    index = IVFIndex.build(engine, n_lists, quantization)
+    index.save(index_dir)
+    logging.info("IVF index → %s", index_dir)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Approximate nearest tracks through an IVF index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="cluster the lowlevel matrix into an IVF index")
+    build.add_argument("--metric", choices=METRICS, default="cosine")
+    build.add_argument("--lists", type=int, default=N_LISTS)
+    build.add_argument("--quantization", choices=sorted(QUANTIZERS), default=QUANTIZATION)
+
+    query = commands.add_parser("query", help="nearest tracks for seed track_ids")
+    query.add_argument("track_ids", nargs="+")
+    query.add_argument("-k", type=int, default=10)
+    query.add_argument("--nprobe", type=int, default=NPROBE)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(metric=args.metric, n_lists=args.lists, quantization=args.quantization)
+    else:
+        index, track_keys = IVFIndex.load(INDEX_DIR), TrackKeyIndex.load(KEY_TABLE)
+        keys = track_keys.keys(args.track_ids)
+        missing = [t for t, indexed in zip(args.track_ids, index.indexed(keys)) if not indexed]
+        if missing:
+            parser.error(f"Not in the index, rebuild it to include them: {missing[:5]}")
+        neighbors, distances = index.search(keys, args.k, args.nprobe)
+        for track_id, row, d in zip(args.track_ids, neighbors, distances):
+            found = row >= 0
+            print(track_id, list(zip(track_keys.ids(row[found]), np.round(d[found], 4))))
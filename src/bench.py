@@ -0,0 +1,317 @@
+import time
+import shutil
+import logging
+import re
+import argparse
+import tempfile
+import unicodedata
+
+import essentia.standard as es
+import ftfy
+import numpy as np
+import pandas as pd
+
+import store
+import metadata
+from ann import IVFIndex
+from quantize import QUANTIZERS
+from lowlevel import (LowLevelExtractor, VectorizedExtractor, make_extractor, excerpts, FRAME_SIZE, HOP_SIZE,
+                      MFCC_VECTOR_COLUMNS, QUICK_SEGMENTS, QUICK_SEGMENT_SECONDS, SAMPLE_RATE)
+from similarity import SimilarityEngine
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+def _best_time(fn, *args, repeat=3):
+    # Best-of-n wall time, which is the least noisy estimate on a shared box.
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _legacy_lowlevel(audio):
+    # Frame loop as it was before LowLevelExtractor: algorithms are rebuilt per track and per frame.
+    window = es.Windowing(type='hann')
+    spectrum = es.Spectrum()
+    mfcc = es.MFCC()
+    w_prev = np.zeros(FRAME_SIZE // 2 + 1)
+
+    for frame in es.FrameGenerator(audio, frameSize=FRAME_SIZE, hopSize=HOP_SIZE, startFromZero=True):
+        spec = spectrum(window(frame))
+        mfcc(spec)
+        es.Centroid()(spec)
+        es.Flatness()(spec)
+        np.sum((spec - w_prev) ** 2)
+        w_prev = spec
+
+    es.RMS()(audio)
+
+
+def bench_extractor(paths, repeat=3):
+    # Per-track wall time of per-frame algorithm construction versus a reused LowLevelExtractor.
+    # Plugins are left out so both sides compute the same core features.
+    extractor = LowLevelExtractor(plugins=[])
+    total_before = total_after = 0.0
+
+    for path in paths:
+        audio = extractor.load(path)
+        before = _best_time(_legacy_lowlevel, audio, repeat=repeat)
+        after = _best_time(extractor.compute, audio, repeat=repeat)
+        total_before += before
+        total_after += after
+        logging.info("%s: %.3fs → %.3fs (%.2fx)", path, before, after, before / after)
+
+    logging.info("Per track: %.3fs → %.3fs (%.2fx) over %d tracks",
+                 total_before / len(paths), total_after / len(paths), total_before / total_after, len(paths))
+
+
+def bench_engines(paths, repeat=3, rtol=1e-3, atol=1e-4):
+    # Times the Essentia loop against the batched NumPy engine and checks their outputs agree
+    # with np.isclose semantics; atol covers means that sit near zero (e.g. higher MFCCs).
+    reference, vectorized = LowLevelExtractor(plugins=[]), VectorizedExtractor(plugins=[])
+    total_before = total_after = 0.0
+    worst, failed = {}, set()
+
+    for path in paths:
+        audio = reference.load(path)
+        before = _best_time(reference.compute, audio, repeat=repeat)
+        after = _best_time(vectorized.compute, audio, repeat=repeat)
+        total_before += before
+        total_after += after
+
+        expected, actual = reference.compute(audio), vectorized.compute(audio)
+        for key, value in expected.items():
+            error = np.abs(actual[key] - value)
+            worst[key] = max(worst.get(key, 0.0), float(np.max(error)))
+            if np.any(error > atol + rtol * np.abs(value)):
+                failed.add(key)
+        logging.info("%s: %.3fs → %.3fs (%.2fx)", path, before, after, before / after)
+
+    for key, error in worst.items():
+        logging.log(logging.WARNING if key in failed else logging.INFO, "%-24s max abs error %.2e %s",
+                    key, error, "FAIL" if key in failed else "ok")
+    logging.info("Per track: %.3fs → %.3fs (%.2fx) over %d tracks",
+                 total_before / len(paths), total_after / len(paths), total_before / total_after, len(paths))
+
+
+def _feature_row(feats):
+    # Flattens an extractor result into (columns, float64 values); scalars the MFCC vector
+    # repeats (mfcc_1_mean, ...) are taken from the vector.
+    scalars = [key for key in feats if key != 'mfcc_vector' and key not in MFCC_VECTOR_COLUMNS]
+    columns = scalars + MFCC_VECTOR_COLUMNS
+    values = [float(feats[key]) for key in scalars] + list(feats['mfcc_vector'])
+    return columns, np.array(values, dtype=np.float64)
+
+
+def bench_quick(paths, segments=QUICK_SEGMENTS, seconds=QUICK_SEGMENT_SECONDS, repeat=1):
+    # Analysis time and feature drift of quick (excerpt) extraction against the full track.
+    # Drift is |quick - full| in standard deviations of the full values over the given tracks,
+    # the units similarity search compares features in, so columns near zero (delta means)
+    # don't blow up as relative errors would. Tracks short enough to be analysed whole have
+    # no drift and are left out of it.
+    extractor = make_extractor()
+    total_full = total_quick = 0.0
+    full_rows, quick_rows, sampled = [], [], []
+
+    for path in paths:
+        audio = extractor.load(path)
+        sample = excerpts(audio, segments, seconds)
+        sampled.append(len(sample) < len(audio))
+        full_time = _best_time(extractor.compute, audio, repeat=repeat)
+        quick_time = _best_time(extractor.compute, sample, repeat=repeat)
+        total_full += full_time
+        total_quick += quick_time
+
+        columns, full = _feature_row(extractor.compute(audio))
+        full_rows.append(full)
+        quick_rows.append(_feature_row(extractor.compute(sample))[1])
+        logging.info("%s: %.1fs of audio, %.3fs → %.3fs (%.2fx)", path, len(audio) / SAMPLE_RATE,
+                     full_time, quick_time, full_time / quick_time)
+
+    full, quick = np.array(full_rows), np.array(quick_rows)
+    spread = full.std(axis=0)
+    drift = (np.abs(quick - full) / np.where(spread > 0, spread, 1.0))[sampled]
+    if not len(drift):
+        logging.warning("Every track is shorter than %d × %gs, nothing was excerpted", segments, seconds)
+        return
+    for column, errors in zip(columns, drift.T):
+        logging.info("%-28s drift median %.3f σ  p90 %.3f σ", column, np.median(errors), np.percentile(errors, 90))
+    logging.info("All columns: drift median %.3f σ, p90 %.3f σ over %d excerpted tracks",
+                 np.median(drift), np.percentile(drift, 90), len(drift))
+    logging.info("Per track: %.3fs → %.3fs (%.2fx) over %d tracks, %d × %gs excerpts",
+                 total_full / len(paths), total_quick / len(paths), total_full / total_quick, len(paths),
+                 segments, seconds)
+
+
+def bench_store(csv_path, rows=(10_000, 100_000), repeat=3):
+    # Disk size and load time of a CSV table replicated to each row count, per store format.
+    source = pd.read_csv(csv_path, float_precision="round_trip")
+    workdir = tempfile.mkdtemp(prefix="synch-store-")
+    numeric = [c for c in source.columns if pd.api.types.is_float_dtype(source[c])][:2]
+
+    try:
+        for n in rows:
+            df = pd.concat([source] * -(-n // len(source)), ignore_index=True).iloc[:n]
+            df['track_id'] = df['track_id'] + "-" + (df.index // len(source)).astype(str)
+            seeds = list(df['track_id'].iloc[::100])
+
+            for fmt in ("csv", "parquet", "arrow"):
+                path = store.table_path(workdir, f"bench-{n}", fmt)
+                store.write_table(df, path)
+                full = _best_time(store.read_table, path, repeat=repeat)
+                projected = _best_time(lambda: store.read_table(path, columns=['track_id'] + numeric), repeat=repeat)
+                filtered = _best_time(lambda: store.read_table(path, filters=[('track_id', 'in', seeds)]), repeat=repeat)
+                logging.info("%7d rows %-7s %8.1f KiB  full %.3fs  %d cols %.3fs  1%% rows %.3fs",
+                             n, fmt, store.table_size(path) / 1024, full, len(numeric) + 1, projected, filtered)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _legacy_clean_string(s):
+    # clean_string as it was before the single-pass rewrite, kept verbatim as the reference.
+    if not s:
+        return None
+
+    s = ftfy.fix_text(str(s))
+    s = unicodedata.normalize("NFC", s)
+
+    s = re.sub(r"[‐-–—−]", "-", s)
+    s = s.replace("'", "'").replace("'", "'").replace(""", '"').replace(""", '"')
+    s = re.sub(r"[\u200B-\u200D\uFEFF]", "", s)
+    s = s.replace("\r", "")
+
+    return s.strip()
+
+
+# Strings that exercise the non-ASCII path; the tag corpus is mostly plain ASCII.
+CLEAN_EDGE_CASES = [
+    "Don\u2019t Stop \u2014 Now", "A\u200bB\ufeff", "Caf\u00e9", "Cafe\u0301", "Line\r\nBreak",
+    "Plain &amp; Simple", "Tom &amp Jerry", "\u2010\u2011\u2012\u2013\u2212", "Ã©tÃ©", "  padded  ", "\x1b[31mred",
+]
+
+TAG_COLUMNS = ["title", "album", "album_artist", "contributing_artists", "genre_tagged"]
+
+
+def bench_clean(csv_path, repeat=5):
+    # clean_string over every tag value of a metadata CSV: legacy vs current, with identical output,
+    # then the LRU cache as a separate speedup.
+    df = pd.read_csv(csv_path, usecols=TAG_COLUMNS, dtype=str, keep_default_na=False)
+    corpus = [v for column in TAG_COLUMNS for v in df[column] if v] + CLEAN_EDGE_CASES
+
+    mismatches = [v for v in corpus if _legacy_clean_string(v) != metadata.clean_string(v)]
+    for value in mismatches[:10]:
+        logging.warning("Mismatch: %r → %r vs %r", value, _legacy_clean_string(value), metadata.clean_string(value))
+
+    # The single-pass normalizer itself, without the LRU cache in front of it.
+    uncached = metadata._clean_text.__wrapped__
+    before = _best_time(lambda: [_legacy_clean_string(v) for v in corpus], repeat=repeat)
+    after = _best_time(lambda: [uncached(v) for v in corpus], repeat=repeat)
+    logging.info("%d strings, %d mismatches: %.3fs → %.3fs (%.1fx), %.2f → %.2f µs/string",
+                 len(corpus), len(mismatches), before, after, before / after,
+                 before / len(corpus) * 1e6, after / len(corpus) * 1e6)
+
+    # The cache on top, cleared per run, so hits only count repeats within one pass over the corpus.
+    cached = _best_time(lambda: (metadata._clean_text.cache_clear(), [metadata.clean_string(v) for v in corpus]), repeat=repeat)
+    logging.info("LRU cache: %.3fs → %.3fs (%.1fx), %d distinct of %d strings",
+                 after, cached, after / cached, len(set(corpus)), len(corpus))
+
+
+def recall_at_k(expected, actual):
+    # Share of the exact top-k found by the approximate search, averaged over seeds.
+    k = expected.shape[1]
+    return np.mean([len(np.intersect1d(e, a)) / k for e, a in zip(expected, actual)])
+
+
+def bench_ann(matrix_path, key_table, metric="cosine", lists=None, nprobes=(1, 2, 4, 8, 16, 32), k=10,
+              queries=1000, quantizations=("none",)):
+    # recall@k, per-query latency and vector memory of the IVF index at each nprobe, per
+    # storage mode, against exact search over float32 vectors.
+    engine = SimilarityEngine.load(matrix_path, key_table, metric)
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(len(engine), min(queries, len(engine)), replace=False))
+    keys = engine.matrix.keys[rows]
+
+    start = time.perf_counter()
+    exact, _ = engine.search(rows, k)
+    batched = time.perf_counter() - start
+    exact = engine.matrix.keys[exact]
+    single = _best_time(lambda: [engine.search(rows[i:i + 1], k) for i in range(min(100, len(rows)))])
+    logging.info("exact: %d tracks, %.3f ms/query one at a time, %.3f ms/query batched, %.1f MiB of vectors",
+                 len(engine), single / min(100, len(rows)) * 1e3, batched / len(rows) * 1e3,
+                 engine.vectors.nbytes / 2 ** 20)
+
+    for quantization in quantizations:
+        start = time.perf_counter()
+        index = IVFIndex.build(engine, lists, None if quantization == "none" else quantization)
+        logging.info("IVF %s build: %.2fs, %.1f MiB of vectors (%.1fx smaller)", quantization,
+                     time.perf_counter() - start, index.nbytes / 2 ** 20, engine.vectors.nbytes / index.nbytes)
+
+        for nprobe in nprobes:
+            elapsed = _best_time(index.search, keys, k, nprobe)
+            approximate, _ = index.search(keys, k, nprobe)
+            logging.info("%-5s nprobe %4d: recall@%d %.4f, %.3f ms/query", quantization, nprobe, k,
+                         recall_at_k(exact, approximate), elapsed / len(keys) * 1e3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synch micro-benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extractor = commands.add_parser("extractor", help="per-frame construction vs reused LowLevelExtractor")
+    extractor.add_argument("paths", nargs="+")
+    extractor.add_argument("--repeat", type=int, default=3)
+
+    engines = commands.add_parser("engines", help="Essentia frame loop vs batched NumPy engine")
+    engines.add_argument("paths", nargs="+")
+    engines.add_argument("--repeat", type=int, default=3)
+    engines.add_argument("--rtol", type=float, default=1e-3)
+    engines.add_argument("--atol", type=float, default=1e-4)
+
+    quick = commands.add_parser("quick", help="quick (excerpt) extraction time and drift against full analysis")
+    quick.add_argument("paths", nargs="+")
+    quick.add_argument("--segments", type=int, default=QUICK_SEGMENTS)
+    quick.add_argument("--seconds", type=float, default=QUICK_SEGMENT_SECONDS)
+    quick.add_argument("--repeat", type=int, default=1)
+
+    table = commands.add_parser("store", help="CSV vs Parquet vs Arrow size and load time")
+    table.add_argument("csv_path")
+    table.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    table.add_argument("--repeat", type=int, default=3)
+
+    clean = commands.add_parser("clean", help="legacy vs single-pass clean_string, and its LRU cache, over a metadata CSV")
+    clean.add_argument("csv_path")
+    clean.add_argument("--repeat", type=int, default=5)
+
+    ann = commands.add_parser("ann", help="IVF recall@k, latency and memory against exact KNN")
+    ann.add_argument("matrix_path")
+    ann.add_argument("key_table")
+    ann.add_argument("--metric", choices=["cosine", "euclidean"], default="cosine")
+    ann.add_argument("--lists", type=int, default=None)
+    ann.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    ann.add_argument("-k", type=int, default=10)
+    ann.add_argument("--queries", type=int, default=1000)
+    ann.add_argument("--quantization", nargs="+", choices=["none"] + sorted(QUANTIZERS), default=["none"])
+
+    args = parser.parse_args()
+
+    if args.command == "extractor":
+        bench_extractor(args.paths, args.repeat)
+    elif args.command == "engines":
+        bench_engines(args.paths, args.repeat, args.rtol, args.atol)
+    elif args.command == "quick":
+        bench_quick(args.paths, args.segments, args.seconds, args.repeat)
+    elif args.command == "store":
+        bench_store(args.csv_path, args.rows, args.repeat)
+    elif args.command == "clean":
+        bench_clean(args.csv_path, args.repeat)
+    elif args.command == "ann":
+        bench_ann(args.matrix_path, args.key_table, args.metric, args.lists, args.nprobe, args.k, args.queries,
+                  args.quantization)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import numpy as np
+
+
+KMEANS_ITERATIONS = 20
+# Training points per centroid; k-means runs on a sample so training stays cheap at 1M tracks.
+KMEANS_SAMPLE = 256
+SEED = 0
+
+
+def nearest_centroid(vectors, centroids, metric, block=65536):
+    # Index of the closest centroid for every vector, one matrix product per block.
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    if metric == "euclidean":
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(vectors), block):
+        products = vectors[start:start + block] @ centroids.T
+        # For unit vectors the nearest centroid is the one with the largest dot product.
+        scores = products if metric == "cosine" else 2.0 * products - centroid_norms
+        assignment[start:start + block] = scores.argmax(axis=1)
+    return assignment
+
+
+def kmeans(vectors, n_centroids, metric, iterations=KMEANS_ITERATIONS, sample=KMEANS_SAMPLE, seed=SEED):
+    # Lloyd's k-means on a random sample; spherical (unit centroids) for cosine.
+    rng = np.random.default_rng(seed)
+    if len(vectors) > n_centroids * sample:
+        vectors = vectors[np.sort(rng.choice(len(vectors), n_centroids * sample, replace=False))]
+    # Strided views (e.g. PQ subvectors) would push every matrix product off the BLAS fast path.
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_centroids = min(n_centroids, len(vectors))
+    centroids = np.array(vectors[rng.choice(len(vectors), n_centroids, replace=False)], dtype=np.float32)
+
+    for _ in range(iterations):
+        assignment = nearest_centroid(vectors, centroids, metric)
+        counts = np.bincount(assignment, minlength=n_centroids)
+        # Per-dimension bincounts sum each cluster far faster than np.add.at.
+        sums = np.stack([np.bincount(assignment, weights=vectors[:, d], minlength=n_centroids)
+                         for d in range(vectors.shape[1])], axis=1)
+        # Empty clusters keep their old centroid rather than collapsing to the origin.
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        if metric == "cosine":
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms == 0, 1.0, norms)
+
+    return centroids
@@ -0,0 +1,40 @@
+import essentia.standard as es
+
+
+# Every file is decoded once, at DECODE_RATE; extractors that want another rate get a
+# resampled copy, made once per rate and shared. A source not at DECODE_RATE is therefore
+# resampled twice for those extractors (e.g. 48 kHz → 44.1 kHz → 16 kHz), so their input can
+# differ slightly from a MonoLoader that resamples straight to the target rate.
+DECODE_RATE = 44100
+# Essentia Resample quality, 0 (best) to 4 (fastest). MonoLoader defaults to 1; 4 is the
+# setting the highlevel MusiCNN models were trained with.
+RESAMPLE_QUALITY = 4
+
+
+class DecodedTrack:
+    # Lazily decoded mono signal of one file, cached per sample rate. With a PCMCache (and
+    # the track_id naming its entries) the DECODE_RATE signal is read from disk when cached
+    # and written there after decoding; other rates are resampled from it rather than cached.
+    # Features match a fresh decode exactly only with pcmcache.PCM_DTYPE = "float32".
+
+    def __init__(self, path, track_id=None, cache=None):
+        self.path = path
+        self.track_id = track_id
+        self.cache = cache if track_id is not None else None
+        self.signals = {}
+
+    def _decode(self):
+        signal = self.cache.get(self.track_id, self.path, DECODE_RATE) if self.cache is not None else None
+        if signal is None:
+            signal = es.MonoLoader(filename=self.path, sampleRate=DECODE_RATE)()
+            if self.cache is not None:
+                self.cache.put(self.track_id, self.path, DECODE_RATE, signal)
+        return signal
+
+    def at(self, rate=DECODE_RATE):
+        if DECODE_RATE not in self.signals:
+            self.signals[DECODE_RATE] = self._decode()
+        if rate not in self.signals:
+            resample = es.Resample(inputSampleRate=DECODE_RATE, outputSampleRate=rate, quality=RESAMPLE_QUALITY)
+            self.signals[rate] = resample(self.signals[DECODE_RATE])
+        return self.signals[rate]
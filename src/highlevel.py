@@ -0,0 +1,288 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import essentia
+import essentia.standard as es
+import numpy as np
+import pandas as pd
+
+import store
+from decode import DecodedTrack
+from lowlevel import expected_fingerprints, queue_tracks, sync_with_metadata
+from matrix import write_matrix
+from pcmcache import shared_cache
+from registry import TrackKeyIndex
+
+
+OUTPUT_DIR = "Path"
+# Essentia model graphs (.pb) from https://essentia.upf.edu/models.html
+MODELS_DIR = os.path.join(OUTPUT_DIR, "models")
+OUTPUT_FORMAT = store.FORMAT
+OUTPUT_TABLE = store.table_path(OUTPUT_DIR, "highlevel", OUTPUT_FORMAT)
+# Memory-mappable float32 matrix of track embeddings, rebuilt at the end of each run.
+EMBEDDINGS_PATH = os.path.join(OUTPUT_DIR, "highlevel_embeddings")
+KEY_TABLE = store.table_path(OUTPUT_DIR, "track_keys", OUTPUT_FORMAT)
+
+# Worker processes that decode audio and compute mel patches; inference stays in the main
+# process, where TensorFlow already spreads one batch over every core.
+WORKERS = os.cpu_count() or 1
+CHECKPOINT_BATCH = 100
+
+# MusiCNN input: 16 kHz audio, 512-sample frames every 256 samples, 96 log-mel bands,
+# cut into patches of 187 frames (3 s) every 93 frames.
+SAMPLE_RATE = 16000
+FRAME_SIZE = 512
+HOP_SIZE = 256
+PATCH_SIZE = 187
+PATCH_HOP = 93
+MEL_BANDS = 96
+
+# Patches per model call. Patches of several tracks share a call, so a batch is full
+# even when tracks are short.
+BATCH_PATCHES = 256
+
+# Model inference needs an Essentia build with TensorFlow (pip install essentia-tensorflow);
+# the pinned essentia wheel has none.
+TENSORFLOW = hasattr(es, "TensorflowPredict")
+
+INPUT_NODE = "model/Placeholder"
+# name: (graph, output node). The MSD MusiCNN backbone; its 200-d output is both the track
+# embedding and the input of every classifier head below.
+EMBEDDING_MODEL = ("msd-musicnn-1.pb", "model/dense/BiasAdd")
+# name: (graph, output node, labels in output order). These are Essentia's classifier heads
+# on msd-musicnn-1 embeddings, not the *-musicnn-msd-2 graphs that each embed their own copy
+# of the backbone, so a batch of patches runs through the backbone once instead of once per
+# classifier. Track activations are patch means.
+CLASSIFIERS = {
+    "genre": ("genre_dortmund-msd-musicnn-1.pb", "model/Softmax",
+              ["alternative", "blues", "electronic", "folkcountry", "funksoulrnb", "jazz", "pop", "raphiphop", "rock"]),
+    "mood_happy": ("mood_happy-msd-musicnn-1.pb", "model/Softmax", ["happy", "non_happy"]),
+    "mood_sad": ("mood_sad-msd-musicnn-1.pb", "model/Softmax", ["non_sad", "sad"]),
+    "mood_aggressive": ("mood_aggressive-msd-musicnn-1.pb", "model/Softmax", ["aggressive", "not_aggressive"]),
+    "mood_relaxed": ("mood_relaxed-msd-musicnn-1.pb", "model/Softmax", ["non_relaxed", "relaxed"]),
+    "mood_party": ("mood_party-msd-musicnn-1.pb", "model/Softmax", ["non_party", "party"]),
+    "danceability": ("danceability-msd-musicnn-1.pb", "model/Softmax", ["danceable", "not_danceable"]),
+}
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+class PatchExtractor:
+    # Log-mel patches of one track, computed once and shared by every model.
+
+    def __init__(self):
+        self.melbands = es.TensorflowInputMusiCNN()
+
+    def load(self, path, track_id=None):
+        # Decoded at decode.DECODE_RATE and resampled with the models' quality setting, through
+        # the PCM cache when it is on and the track_id is known.
+        return DecodedTrack(path, track_id, shared_cache()).at(SAMPLE_RATE)
+
+    def compute(self, audio):
+        bands = np.array([self.melbands(frame) for frame in
+                          es.FrameGenerator(audio, frameSize=FRAME_SIZE, hopSize=HOP_SIZE, startFromZero=True)],
+                         dtype=np.float32).reshape(-1, MEL_BANDS)
+
+        # Tracks shorter than one patch are padded with silence (log-mel 0); otherwise the
+        # trailing partial patch is dropped.
+        if len(bands) < PATCH_SIZE:
+            bands = np.vstack([bands, np.zeros((PATCH_SIZE - len(bands), MEL_BANDS), dtype=np.float32)])
+        starts = range(0, len(bands) - PATCH_SIZE + 1, PATCH_HOP)
+        return np.stack([bands[start:start + PATCH_SIZE] for start in starts])
+
+    def __call__(self, path, track_id=None):
+        return self.compute(self.load(path, track_id))
+
+
+_patcher = None
+
+
+def _patch_task(task):
+    # Returns None for tracks that fail to decode, so one bad file doesn't stop the run.
+    global _patcher
+    if _patcher is None:
+        _patcher = make_extractor()
+    track_id, file_path = task
+    try:
+        return track_id, _patcher(file_path, track_id)
+    except Exception as e:
+        logging.error("Failed on %s: %s", file_path, e)
+        return track_id, None
+
+
+def patches_parallel(tasks, workers=WORKERS):
+    # (track_id, patches) in task order; workers run ahead of inference in the main process.
+    if workers <= 1:
+        for task in tasks:
+            yield _patch_task(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_patch_task, tasks, chunksize=4)
+
+
+class TensorflowModel:
+    # One frozen Essentia graph, called on a whole batch of patches or embeddings at a time.
+
+    def __init__(self, graph, output):
+        if not TENSORFLOW:
+            raise RuntimeError("This Essentia build has no TensorFlow support (pip install essentia-tensorflow)")
+        self.output = output
+        self.predict = es.TensorflowPredict(graphFilename=os.path.join(MODELS_DIR, graph),
+                                            inputs=[INPUT_NODE], outputs=[output])
+
+    def __call__(self, inputs):
+        # inputs: patches (n, PATCH_SIZE, MEL_BANDS) for the backbone, embeddings (n, dims) for
+        # a classifier head → (n, outputs), in chunks of BATCH_PATCHES.
+        results = []
+        for start in range(0, len(inputs), BATCH_PATCHES):
+            chunk = inputs[start:start + BATCH_PATCHES]
+            pool = essentia.Pool()
+            # TensorflowPredict takes 4-D tensors and squeezes the singleton axes padded in here.
+            pool.set(INPUT_NODE, chunk.reshape((len(chunk),) + (1,) * (4 - chunk.ndim) + chunk.shape[1:]))
+            results.append(np.asarray(self.predict(pool)[self.output], dtype=np.float32).reshape(len(chunk), -1))
+        return np.vstack(results)
+
+
+class HighLevelExtractor:
+    # Runs the embedding model over patches pooled from many tracks and every classifier head
+    # over its embeddings: add() buffers a track's patches, and once BATCH_PATCHES are waiting,
+    # flush() makes one call per model and splits the outputs back into per-track means.
+
+    def __init__(self, models=None):
+        self.models = models if models is not None else self.load_models()
+        self.pending = []
+        self.pending_patches = 0
+
+    @staticmethod
+    def load_models():
+        models = {"embedding": TensorflowModel(*EMBEDDING_MODEL)}
+        for name, (graph, output, _) in CLASSIFIERS.items():
+            models[name] = TensorflowModel(graph, output)
+        return models
+
+    def add(self, track_id, patches):
+        # Returns finished rows whenever a full batch was run, else an empty list.
+        self.pending.append((track_id, patches))
+        self.pending_patches += len(patches)
+        return self.flush() if self.pending_patches >= BATCH_PATCHES else []
+
+    def flush(self):
+        if not self.pending:
+            return []
+        track_ids = [track_id for track_id, _ in self.pending]
+        patches = np.concatenate([p for _, p in self.pending])
+        bounds = np.cumsum([0] + [len(p) for _, p in self.pending])
+        self.pending, self.pending_patches = [], 0
+
+        embeddings = self.models["embedding"](patches)
+        outputs = {name: embeddings if name == "embedding" else model(embeddings)
+                   for name, model in self.models.items()}
+
+        rows = []
+        for i, track_id in enumerate(track_ids):
+            row = {'track_id': track_id, 'patches': int(bounds[i + 1] - bounds[i])}
+            for name, values in outputs.items():
+                mean = values[bounds[i]:bounds[i + 1]].mean(axis=0)
+                labels = CLASSIFIERS[name][2] if name in CLASSIFIERS else range(len(mean))
+                row.update({f"{name}_{label}": float(v) for label, v in zip(labels, mean)})
+            rows.append(row)
+        return rows
+
+
+def write_embedding_matrix(df, path=EMBEDDINGS_PATH, key_table=KEY_TABLE):
+    # Embedding columns of the table as one float32 row per track, keyed by int32 track key.
+    columns = [c for c in df.columns if c.startswith("embedding_")]
+    keys = TrackKeyIndex.load(key_table)
+    keys.add(df['track_id'])
+    if keys.dirty:
+        keys.save()
+    write_matrix(path, keys.keys(df['track_id']), columns, df[columns].to_numpy(np.float32))
+    logging.info("Embedding matrix: %d × %d → %s.npy", len(df), len(columns), path)
+
+
+def load_metadata():
+    return store.load_metadata(OUTPUT_DIR)
+
+
+def pending_tracks(metadata_df, resume=True):
+    # Same incremental rule as lowlevel: only new or changed files are run through the models.
+    if not resume:
+        store.remove_table(OUTPUT_TABLE)
+
+    expected = expected_fingerprints(metadata_df, OUTPUT_DIR)
+    done_ids = sync_with_metadata(OUTPUT_TABLE, expected, None, None)
+    return expected, done_ids, queue_tracks(metadata_df, done_ids)
+
+
+class PatchWriter:
+    # Feeds patches to the batched models and appends finished rows every CHECKPOINT_BATCH
+    # tracks. Tracks whose patches failed (None) are skipped and retried next run.
+
+    def __init__(self, expected, extractor=None):
+        self.expected = expected
+        self.extractor = extractor if extractor is not None else HighLevelExtractor()
+        self.batch = []
+        self.processed = 0
+
+    def _collect(self, rows):
+        for row in rows:
+            row['fingerprint'] = self.expected[row['track_id']]
+        self.batch.extend(rows)
+        self.processed += len(rows)
+
+    def add(self, track_id, patches):
+        if patches is not None:
+            self._collect(self.extractor.add(track_id, patches))
+        if len(self.batch) >= CHECKPOINT_BATCH:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        if self.batch:
+            store.append_table(pd.DataFrame(self.batch), OUTPUT_TABLE)
+            self.batch = []
+
+    def close(self):
+        self._collect(self.extractor.flush())
+        self._checkpoint()
+
+
+def make_extractor():
+    return PatchExtractor()
+
+
+def open_writer(expected):
+    return PatchWriter(expected)
+
+
+def finish(metadata_df, processed):
+    if not store.table_exists(OUTPUT_TABLE):
+        logging.warning("No features extracted!")
+        return
+
+    df = store.in_metadata_order(store.read_table(OUTPUT_TABLE), metadata_df)
+    store.write_table(df, OUTPUT_TABLE)
+    logging.info("Done: %d new tracks, %d total → %s", processed, len(df), OUTPUT_TABLE)
+
+    write_embedding_matrix(df, EMBEDDINGS_PATH, KEY_TABLE)
+
+
+def main(workers=WORKERS, resume=True):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    metadata_df = load_metadata()
+
+    expected, done_ids, tasks = pending_tracks(metadata_df, resume)
+    logging.info("Up to date: %d tracks, %d to extract with %d workers", len(done_ids), len(tasks), workers)
+
+    writer = open_writer(expected)
+    for done, (track_id, patches) in enumerate(patches_parallel(tasks, workers), 1):
+        logging.info("[%d/%d] Patched: %s", done, len(tasks), track_id)
+        writer.add(track_id, patches)
+    writer.close()
+
+    finish(metadata_df, writer.processed)
+
+
+if __name__ == "__main__":
+    main()
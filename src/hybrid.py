@@ -0,0 +1,183 @@
+import os
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from matrix import open_matrix
+from registry import TrackKeyIndex
+from similarity import SimilarityEngine, top_k, METRICS, MATRIX_PATH, KEY_TABLE, QUERY_BLOCK
+
+
+OUTPUT_DIR = "Path"
+# Sentence-BERT lyric embeddings, one row per track key, written with matrix.write_matrix.
+LYRICS_MATRIX_PATH = os.path.join(OUTPUT_DIR, "lyrics_matrix")
+
+# Default query-time weights; they are normalized to sum to 1 over the loaded modalities.
+MODALITY_WEIGHTS = {"audio": 0.7, "lyrics": 0.3}
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+class HybridEngine:
+    # Exact KNN over several modalities (audio features, lyric embeddings) scored together.
+    # Each modality keeps its own standardized block, aligned to the catalogue of the first
+    # one (audio); a block is never concatenated with or scaled by the others. The fused
+    # distance is the weighted mean of per-modality distances, so only the per-query
+    # weights change between queries:
+    #   cosine:    1 - Σ w·cos / Σ w
+    #   euclidean: √(Σ w·d²/dims / Σ w), dividing by dims so wide blocks don't dominate
+    # A track missing from a modality (no lyrics) is scored on the modalities it has: the
+    # sums run only over modalities that both seed and candidate have.
+
+    def __init__(self, engines, weights=MODALITY_WEIGHTS):
+        metrics = {engine.metric for engine in engines.values()}
+        if len(metrics) != 1:
+            raise ValueError(f"Modalities use different metrics: {sorted(metrics)}")
+        self.metric = metrics.pop()
+        self.names = list(engines)
+        # Default weights of modalities that aren't loaded (lyrics missing) are dropped.
+        self.weights = {name: w for name, w in weights.items() if name in self.names}
+
+        base = engines[self.names[0]]
+        self.base = base
+        self.keys = base.keys
+        self.catalogue = base.matrix.keys
+        self.blocks, self.present = {}, {}
+        for name, engine in engines.items():
+            self.blocks[name], self.present[name] = self._align(engine)
+        if self.metric == "euclidean":
+            self.sq_norms = {name: np.einsum("ij,ij->i", block, block) for name, block in self.blocks.items()}
+
+    def _align(self, engine):
+        # The modality's vectors in catalogue order, zero rows where a track has none.
+        known = (self.catalogue < len(engine.matrix.row_of_key))
+        rows = np.full(len(self.catalogue), -1, dtype=np.int64)
+        rows[known] = engine.matrix.row_of_key[self.catalogue[known]]
+        present = rows >= 0
+
+        if present.all() and np.array_equal(rows, np.arange(len(rows))):
+            return engine.vectors, present
+        block = np.zeros((len(self.catalogue), engine.vectors.shape[1]), dtype=np.float32)
+        block[present] = engine.vectors[rows[present]]
+        return block, present
+
+    @classmethod
+    def load(cls, matrix_path=MATRIX_PATH, lyrics_path=LYRICS_MATRIX_PATH, key_table=KEY_TABLE,
+             metric="cosine", weights=MODALITY_WEIGHTS):
+        keys = TrackKeyIndex.load(key_table)
+        engines = {"audio": SimilarityEngine(open_matrix(matrix_path), keys, metric)}
+        if os.path.exists(lyrics_path + ".npy"):
+            engines["lyrics"] = SimilarityEngine(open_matrix(lyrics_path), keys, metric)
+        else:
+            logging.warning("No lyric embeddings at %s, searching audio only", lyrics_path)
+        return cls(engines, weights)
+
+    def __len__(self):
+        return len(self.catalogue)
+
+    def rows(self, track_ids):
+        # Catalogue rows are the first modality's matrix rows.
+        return self.base.rows(track_ids)
+
+    def _weights(self, weights):
+        weights = self.weights if weights is None else weights
+        unknown = set(weights) - set(self.names)
+        if unknown:
+            raise ValueError(f"Unknown modalities: {sorted(unknown)} (loaded: {self.names})")
+        weights = {name: float(weights.get(name, 0.0)) for name in self.names}
+        # Fused distances divide by the weights of the modalities a pair shares, so they must
+        # be non-negative and not all zero.
+        negative = sorted(name for name, w in weights.items() if w < 0)
+        if negative:
+            raise ValueError(f"Negative weights for {negative}")
+        if not sum(weights.values()) > 0:
+            raise ValueError(f"Weights sum to 0 over the loaded modalities {self.names}")
+        return weights
+
+    def distances(self, rows, weights=None):
+        # Seeds × catalogue fused distance block. Weights scale the small per-block score
+        # matrices, never the stored vectors.
+        weights = self._weights(weights)
+        total = np.zeros((len(rows), len(self)), dtype=np.float32)
+        weight_sum = np.zeros((len(rows), len(self)), dtype=np.float32)
+
+        for name, w in weights.items():
+            if w == 0:
+                continue
+            block, present = self.blocks[name], self.present[name]
+            products = block[rows] @ block.T
+            if self.metric == "cosine":
+                scores = products
+            else:
+                norms = self.sq_norms[name]
+                scores = np.maximum(norms[rows, None] + norms[None, :] - 2.0 * products, 0.0) / block.shape[1]
+            both = present[rows, None] & present[None, :]
+            total += np.where(both, w * scores, 0.0)
+            weight_sum += np.where(both, w, 0.0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fused = total / weight_sum
+        fused = 1.0 - fused if self.metric == "cosine" else np.sqrt(fused)
+        # Pairs that share no weighted modality can't be compared.
+        fused[weight_sum == 0] = np.inf
+        return fused
+
+    def search(self, rows, k=10, weights=None, block=QUERY_BLOCK):
+        # Top-k catalogue rows and fused distances for each seed row, nearest first, seeds excluded.
+        # Slots past the tracks comparable with the seed (none share a weighted modality)
+        # hold row -1, as IVFIndex.search pads them.
+        rows = np.asarray(rows, dtype=np.int64)
+        k = min(k, len(self) - 1)
+        neighbors = np.empty((len(rows), k), dtype=np.int64)
+        distances = np.empty((len(rows), k), dtype=np.float32)
+
+        for start in range(0, len(rows), block):
+            seeds = rows[start:start + block]
+            d = self.distances(seeds, weights)
+            d[np.arange(len(seeds)), seeds] = np.inf
+            neighbors[start:start + len(seeds)], distances[start:start + len(seeds)] = top_k(d, k)
+
+        neighbors[np.isinf(distances)] = -1
+        return neighbors, distances
+
+    def query_many(self, track_ids, k=10, weights=None, block=QUERY_BLOCK):
+        # Neighbors of many seeds at once as a long table: seed, rank, track_id, distance.
+        # Seeds with fewer than k comparable tracks get fewer rows.
+        track_ids = list(track_ids)
+        neighbors, distances = self.search(self.rows(track_ids), k, weights, block)
+        n, k = neighbors.shape
+        found = neighbors.ravel() >= 0
+        return pd.DataFrame({
+            "seed": np.repeat(np.asarray(track_ids, dtype=object), k)[found],
+            "rank": np.tile(np.arange(1, k + 1), n)[found],
+            "track_id": self.keys.ids(self.catalogue[neighbors.ravel()[found]]),
+            "distance": distances.ravel()[found],
+        })
+
+    def query(self, track_id, k=10, weights=None):
+        df = self.query_many([track_id], k, weights)
+        return list(zip(df["track_id"], df["distance"]))
+
+
+def parse_weights(values):
+    # "audio=0.7 lyrics=0.3" → {"audio": 0.7, "lyrics": 0.3}
+    weights = {}
+    for value in values:
+        name, _, weight = value.partition("=")
+        weights[name] = float(weight)
+    return weights
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nearest tracks by audio features and lyric embeddings")
+    parser.add_argument("track_ids", nargs="+")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--metric", choices=METRICS, default="cosine")
+    parser.add_argument("--weights", nargs="+", default=None, help="e.g. audio=0.7 lyrics=0.3")
+    args = parser.parse_args()
+
+    engine = HybridEngine.load(metric=args.metric)
+    weights = parse_weights(args.weights) if args.weights else None
+    print(engine.query_many(args.track_ids, args.k, weights).to_string(index=False))
@@ -1,96 +1,609 @@
 import os
 import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import essentia.standard as es
 import pandas as pd
 import numpy as np
 
+import store
+from decode import DecodedTrack
+from matrix import write_matrix
+from pcmcache import shared_cache
+from registry import TrackKeyIndex
+from plugins import FeaturePlugin, WAVEFORM, FRAME, WINDOWED, SPECTRUM
+from spectral import SpectralEngine, frame_signal
+from stats import RunningStats
+
 
 OUTPUT_DIR = "Path"
+OUTPUT_FORMAT = store.FORMAT
+OUTPUT_TABLE = store.table_path(OUTPUT_DIR, "lowlevel", OUTPUT_FORMAT)
+# Optional CSV copy of the final table for the notebook and ad-hoc inspection.
+EXPORT_CSV = False
 OUTPUT_CSV = os.path.join(OUTPUT_DIR, "lowlevel.csv")
-METADATA_CSV = os.path.join(OUTPUT_DIR, "metadata.csv")
+# Full MFCC statistics: raw float32 rows in MFCC_BIN, one track_id per line in MFCC_IDS.
+MFCC_BIN = os.path.join(OUTPUT_DIR, "lowlevel_mfcc.f32")
+MFCC_IDS = os.path.join(OUTPUT_DIR, "lowlevel_mfcc.ids")
+# Memory-mappable float32 matrix of every feature, rebuilt at the end of each run.
+MATRIX_PATH = os.path.join(OUTPUT_DIR, "lowlevel_matrix")
+# track_id ↔ int32 key index shared with metadata.py; matrix rows are addressed by key.
+KEY_TABLE = store.table_path(OUTPUT_DIR, "track_keys", OUTPUT_FORMAT)
+
+# Worker processes for extraction; 1 runs everything in-process.
+WORKERS = os.cpu_count() or 1
+
+# Completed rows are appended to OUTPUT_TABLE every CHECKPOINT_BATCH tracks.
+CHECKPOINT_BATCH = 100
+
+# Decode rate; MonoLoader's default, which the spectral settings below assume.
+SAMPLE_RATE = 44100
+FRAME_SIZE = 2048
+HOP_SIZE = 1024
+
+NUMBER_COEFFICIENTS = 13
+# Row layout of MFCC_BIN: per-coefficient mean, std, and mean/std of the frame-to-frame delta.
+MFCC_VECTOR_LAYOUT = ("mean", "std", "delta_mean", "delta_std")
+MFCC_VECTOR_SIZE = NUMBER_COEFFICIENTS * len(MFCC_VECTOR_LAYOUT)
+MFCC_VECTOR_COLUMNS = [f"mfcc_{i + 1}_{stat}" for stat in MFCC_VECTOR_LAYOUT for i in range(NUMBER_COEFFICIENTS)]
+
+# Table columns of the core features; MFCC statistics beyond these live in MFCC_BIN.
+CORE_COLUMNS = ['mfcc_1_mean', 'mfcc_1_std', 'mfcc_13_mean', 'spectral_centroid_mean', 'spectral_centroid_std',
+                'spectral_flatness_mean', 'spectral_flux_mean', 'rms_mean']
+
+# Extra feature plugins (see plugins.py), run in the same framing pass as the core features,
+# e.g. [SpectralRolloff, ZeroCrossingRate]. None by default: adding one adds its columns to
+# the table and the feature matrix, and re-extracts every track on the next run.
+PLUGINS = []
+PLUGIN_COLUMNS = [column for plugin in PLUGINS for column in plugin.columns]
+
+# Table columns carried into the feature matrix; the MFCC columns come from MFCC_BIN instead.
+MATRIX_SCALARS = ['spectral_centroid_mean', 'spectral_centroid_std', 'spectral_flatness_mean',
+                  'spectral_flux_mean', 'rms_mean'] + PLUGIN_COLUMNS
+
+# "essentia" runs the reference per-frame loop; "numpy" the batched VectorizedExtractor.
+ENGINE = "essentia"
+# Frames per batched rFFT call / statistics update, bounding per-track memory.
+FRAME_BLOCK = 1024
+
+# Quick mode (main(quick=True)) analyses QUICK_SEGMENTS excerpts of QUICK_SEGMENT_SECONDS,
+# spread evenly over each track, so new tracks are searchable within seconds. Their rows
+# are marked resolution "quick" and re-extracted in full by the next regular run.
+QUICK_SEGMENTS = 3
+QUICK_SEGMENT_SECONDS = 30
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
-def extract_lowlevel(file_path):
-    # Computes MFCC and coarse spectral statistics per track.
-    try:
-        audio = es.MonoLoader(filename=file_path)()
-    except Exception as e:
-        logging.error("Failed loading %s: %s", file_path, e)
-        return None
-
-    frame_size = 2048
-    hop_size = 1024
-    window = es.Windowing(type='hann')
-    spectrum = es.Spectrum()
-    mfcc = es.MFCC()
-
-    mfcc_coeffs, spectral_centroids, spectral_flatnesses, spectral_fluxes = [], [], [], []
-    w_prev = np.zeros(frame_size // 2 + 1)
-
-    for frame in es.FrameGenerator(audio, frameSize=frame_size, hopSize=hop_size, startFromZero=True):
-        w = window(frame)
-        spec = spectrum(w)
-        _, mfcc_c = mfcc(spec)
-        mfcc_coeffs.append(mfcc_c)
-        spectral_centroids.append(es.Centroid()(spec))
-        spectral_flatnesses.append(es.Flatness()(spec))
-        spectral_fluxes.append(np.sum((spec - w_prev) ** 2))
-        w_prev = spec
-
-    mfcc_coeffs = np.array(mfcc_coeffs)
-    spectral_centroids = np.array(spectral_centroids)
-    spectral_flatnesses = np.array(spectral_flatnesses)
-    spectral_fluxes = np.array(spectral_fluxes)
-    rms_mean = es.RMS()(audio)
-
-    return {
-        'mfcc_1_mean': np.mean(mfcc_coeffs[:,0]) if mfcc_coeffs.size else 0,
-        'mfcc_1_std': np.std(mfcc_coeffs[:,0]) if mfcc_coeffs.size else 0,
-        'mfcc_13_mean': np.mean(mfcc_coeffs[:,12]) if mfcc_coeffs.shape[1] > 12 else 0,
-        'spectral_centroid_mean': np.mean(spectral_centroids) if spectral_centroids.size else 0,
-        'spectral_centroid_std': np.std(spectral_centroids) if spectral_centroids.size else 0,
-        'spectral_flatness_mean': np.mean(spectral_flatnesses) if spectral_flatnesses.size else 0,
-        'spectral_flux_mean': np.mean(spectral_fluxes) if spectral_fluxes.size else 0,
-        'rms_mean': rms_mean
-    }
-
-
-def main():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+class FrameStats:
+    # Running per-track statistics, fed one block of frames at a time so memory is constant.
+
+    def __init__(self, number_coefficients=NUMBER_COEFFICIENTS):
+        self.mfcc = RunningStats((number_coefficients,))
+        self.delta = RunningStats((number_coefficients,))
+        self.previous = None
+        self.centroid = RunningStats()
+        self.flatness = RunningStats()
+        self.flux = RunningStats()
+
+    def update(self, mfcc_coeffs, spectral_centroids, spectral_flatnesses, spectral_fluxes):
+        mfcc_coeffs = np.asarray(mfcc_coeffs, dtype=np.float64)
+        if len(mfcc_coeffs) == 0:
+            return
+
+        # Deltas continue across blocks from the last frame of the previous one.
+        if self.previous is not None:
+            self.delta.update(np.diff(np.vstack([self.previous, mfcc_coeffs]), axis=0))
+        else:
+            self.delta.update(np.diff(mfcc_coeffs, axis=0))
+        self.previous = mfcc_coeffs[-1]
+
+        self.mfcc.update(mfcc_coeffs)
+        self.centroid.update(spectral_centroids)
+        self.flatness.update(spectral_flatnesses)
+        self.flux.update(spectral_fluxes)
+
+    def summary(self, rms_mean):
+        # Reduces the running statistics to the track-level feature row.
+        if not self.mfcc.count:
+            # Typed zeros keep batches of empty tracks schema-compatible with the rest.
+            zero = np.float32(0)
+            return {
+                'mfcc_1_mean': zero, 'mfcc_1_std': zero, 'mfcc_13_mean': zero,
+                'spectral_centroid_mean': 0.0, 'spectral_centroid_std': 0.0,
+                'spectral_flatness_mean': 0.0, 'spectral_flux_mean': 0.0,
+                'rms_mean': rms_mean,
+                'mfcc_vector': np.zeros(MFCC_VECTOR_SIZE, dtype=np.float32)
+            }
+
+        # MFCCs stay float32 like the Essentia output they summarize.
+        mfcc_mean = self.mfcc.mean.astype(np.float32)
+        mfcc_std = self.mfcc.std().astype(np.float32)
+        return {
+            'mfcc_1_mean': mfcc_mean[0],
+            'mfcc_1_std': mfcc_std[0],
+            'mfcc_13_mean': mfcc_mean[12] if len(mfcc_mean) > 12 else np.float32(0),
+            'spectral_centroid_mean': float(self.centroid.mean),
+            'spectral_centroid_std': float(self.centroid.std()),
+            'spectral_flatness_mean': float(self.flatness.mean),
+            'spectral_flux_mean': float(self.flux.mean),
+            'rms_mean': rms_mean,
+            'mfcc_vector': np.concatenate([mfcc_mean, mfcc_std, self.delta.mean, self.delta.std()]).astype(np.float32)
+        }
+
+
+class EssentiaFeatures(FeaturePlugin):
+    # The core features (MFCC, centroid, flatness, flux, RMS) from Essentia's algorithms,
+    # frame by frame: the reference implementation.
+
+    needs = (WAVEFORM, SPECTRUM)
+    columns = CORE_COLUMNS
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_size=FRAME_SIZE):
+        super().__init__(sample_rate, frame_size)
+        self.mfcc = es.MFCC()
+        self.centroid = es.Centroid()
+        self.flatness = es.Flatness()
+        self.rms = es.RMS()
+
+    def start(self, audio):
+        self.stats = FrameStats()
+        self.previous = np.zeros(self.frame_size // 2 + 1)
+        self.rms_mean = self.rms(audio)
+
+    def update(self, frames, windowed, spectra):
+        mfcc_coeffs, spectral_centroids, spectral_flatnesses, spectral_fluxes = [], [], [], []
+        for spec in spectra:
+            _, mfcc_c = self.mfcc(spec)
+            mfcc_coeffs.append(mfcc_c)
+            spectral_centroids.append(self.centroid(spec))
+            spectral_flatnesses.append(self.flatness(spec))
+            spectral_fluxes.append(np.sum((spec - self.previous) ** 2))
+            self.previous = spec
+        self.stats.update(mfcc_coeffs, spectral_centroids, spectral_flatnesses, spectral_fluxes)
+
+    def summary(self):
+        return self.stats.summary(self.rms_mean)
+
+
+class VectorizedFeatures(EssentiaFeatures):
+    # The same core features as array reductions over a whole block of spectra.
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_size=FRAME_SIZE, engine=None):
+        super().__init__(sample_rate, frame_size)
+        self.engine = engine if engine is not None else SpectralEngine(frame_size, sample_rate)
+
+    def update(self, frames, windowed, spectra):
+        self.stats.update(self.engine.mfcc(spectra), self.engine.centroid(spectra),
+                          self.engine.flatness(spectra), self.engine.flux(spectra, self.previous))
+        self.previous = spectra[-1]
+
+
+class LowLevelExtractor:
+    # Runs the core features and every plugin in PLUGINS over one framing pass: each frame is
+    # windowed and transformed once, in blocks of FRAME_BLOCK, and each block is handed to
+    # all plugins. Window and spectrum come from Essentia's algorithms, frame by frame.
+
+    def __init__(self, frame_size=FRAME_SIZE, hop_size=HOP_SIZE, plugins=None):
+        self.frame_size = frame_size
+        self.hop_size = hop_size
+        self.window = es.Windowing(type='hann')
+        self.spectrum = es.Spectrum()
+        self.plugins = [self.core_features()] + [plugin(SAMPLE_RATE, frame_size)
+                                                 for plugin in (PLUGINS if plugins is None else plugins)]
+        needs = {need for plugin in self.plugins for need in plugin.needs}
+        self.keep_frames = FRAME in needs
+        self.keep_windowed = WINDOWED in needs
+
+    def core_features(self):
+        return EssentiaFeatures(SAMPLE_RATE, self.frame_size)
+
+    def load(self, file_path, track_id=None):
+        # Goes through the PCM cache when it is on and the track_id is known.
+        return DecodedTrack(file_path, track_id, shared_cache()).at(SAMPLE_RATE)
+
+    def dispatch(self, frames, windowed, spectra):
+        # Hands one block to every plugin, withholding the inputs it didn't ask for.
+        for plugin in self.plugins:
+            plugin.update(frames if FRAME in plugin.needs else None,
+                          windowed if WINDOWED in plugin.needs else None,
+                          spectra if SPECTRUM in plugin.needs else None)
+
+    def start(self, audio):
+        for plugin in self.plugins:
+            plugin.start(audio)
+
+    def summary(self):
+        feats = {}
+        for plugin in self.plugins:
+            feats.update(plugin.summary())
+        return feats
+
+    def compute(self, audio):
+        # Computes MFCC, coarse spectral statistics and the plugin features for a mono signal.
+        self.start(audio)
+        frames, windowed, spectra = [], [], []
+
+        for frame in es.FrameGenerator(audio, frameSize=self.frame_size, hopSize=self.hop_size, startFromZero=True):
+            w = self.window(frame)
+            spectra.append(self.spectrum(w))
+            if self.keep_frames:
+                frames.append(frame)
+            if self.keep_windowed:
+                windowed.append(w)
+
+            if len(spectra) == FRAME_BLOCK:
+                self.dispatch(np.array(frames), np.array(windowed), np.array(spectra))
+                frames, windowed, spectra = [], [], []
+
+        if spectra:
+            self.dispatch(np.array(frames), np.array(windowed), np.array(spectra))
+        return self.summary()
+
+    def __call__(self, file_path, track_id=None, quick=False):
+        try:
+            audio = self.load(file_path, track_id)
+        except Exception as e:
+            logging.error("Failed loading %s: %s", file_path, e)
+            return None
+
+        return self.compute(excerpts(audio) if quick else audio)
+
+
+class VectorizedExtractor(LowLevelExtractor):
+    # Same features without a per-frame Python loop: the signal is framed as a strided view
+    # and each block of FRAME_BLOCK frames goes through one batched rFFT and array reductions.
+
+    def __init__(self, frame_size=FRAME_SIZE, hop_size=HOP_SIZE, block=FRAME_BLOCK, plugins=None):
+        self.engine = SpectralEngine(frame_size, SAMPLE_RATE)
+        self.block = block
+        super().__init__(frame_size, hop_size, plugins)
+
+    def core_features(self):
+        return VectorizedFeatures(SAMPLE_RATE, self.frame_size, self.engine)
+
+    def compute(self, audio):
+        self.start(audio)
+        frames = frame_signal(audio, self.frame_size, self.hop_size)
+
+        for start in range(0, len(frames), self.block):
+            block = frames[start:start + self.block]
+            windowed = self.engine.windowed(block)
+            self.dispatch(block, windowed, self.engine.magnitude(windowed))
+
+        return self.summary()
+
+
+ENGINES = {"essentia": LowLevelExtractor, "numpy": VectorizedExtractor}
+
+
+def make_extractor():
+    return ENGINES[ENGINE]()
+
+
+def excerpts(audio, segments=QUICK_SEGMENTS, seconds=QUICK_SEGMENT_SECONDS, sample_rate=SAMPLE_RATE):
+    # `segments` evenly spaced excerpts of `seconds` each, joined end to end, skipping the
+    # intro and outro. Tracks no longer than the excerpts together are returned whole.
+    length = int(seconds * sample_rate)
+    if len(audio) <= segments * length:
+        return audio
+    starts = np.linspace(0, len(audio) - length, segments + 2)[1:-1].astype(int)
+    return np.concatenate([audio[start:start + length] for start in starts])
+
+
+# One extractor per process, built on first use inside each worker.
+_extractor = None
+
+
+def extract_lowlevel(file_path, track_id=None, quick=False):
+    # Computes MFCC and coarse spectral statistics per track, over excerpts only if quick.
+    global _extractor
+    if _extractor is None:
+        _extractor = make_extractor()
+    return _extractor(file_path, track_id, quick)
+
+
+def _extract_task(task, quick=False):
+    track_id, file_path = task
+    return track_id, extract_lowlevel(file_path, track_id, quick)
+
 
-    # Load track metadata
-    metadata_df = pd.read_csv(METADATA_CSV)
-    logging.info("Loaded metadata: %d tracks", len(metadata_df))
+def extract_parallel(tasks, workers=WORKERS, quick=False):
+    # Fans (track_id, file_path) tasks out to worker processes, yielding results as they complete.
+    if workers <= 1:
+        for task in tasks:
+            yield _extract_task(task, quick)
+        return
 
-    all_features = []
-    processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_extract_task, task, quick) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
 
-    for _, row in metadata_df.iterrows():
-        file_path = row['file_path']
-        track_id = row['track_id']
 
-        if not os.path.exists(file_path):
-            logging.warning("File not found: %s", file_path)
+def load_checkpoint(path):
+    # Returns track_ids already written to path, dropping CSV rows truncated by a crash
+    # mid-write. Columnar parts are renamed into place whole, so only track_id is read.
+    if not store.table_exists(path):
+        return set()
+
+    if store.table_format(path) != "csv":
+        return set(store.read_table(path, columns=['track_id'])['track_id'])
+
+    df = store.read_table(path)
+    complete = df.dropna(subset=[c for c in df.columns if c != 'fingerprint'])
+    if len(complete) < len(df):
+        logging.warning("Dropping %d incomplete rows from %s", len(df) - len(complete), path)
+        store.write_table(complete, path)
+
+    return set(complete['track_id'])
+
+
+def fingerprint(size, mtime_ns, content_hash):
+    # With a content hash the mtime is left out, matching metadata.fingerprint_unchanged: a
+    # touched or copied file keeps its fingerprint and its features.
+    return f"{size}:{content_hash}" if content_hash else f"{size}:{mtime_ns}"
+
+
+def file_fingerprints(directory):
+    # Maps file_path to the fingerprint recorded by the last metadata scan, if there was one.
+    path = store.find_table(directory, "fingerprints")
+    if path is None:
+        return {}
+
+    df = store.read_table(path)
+    df['content_hash'] = df['content_hash'].fillna("")
+    return {r.file_path: fingerprint(r.size, r.mtime_ns, r.content_hash) for r in df.itertuples()}
+
+
+def sync_with_metadata(path, expected, bin_path=MFCC_BIN, ids_path=MFCC_IDS):
+    # Returns track_ids whose features are current. Rows for tracks that left the metadata, or
+    # whose file fingerprint changed since extraction, are deleted with their MFCC vectors.
+    # expected maps track_id to the current fingerprint ("" when unknown, which matches anything).
+    # Tables without an MFCC sidecar pass bin_path=None.
+    if not load_checkpoint(path):
+        return set()
+
+    df = store.read_table(path)
+    if 'fingerprint' not in df:
+        df['fingerprint'] = ""
+    df['fingerprint'] = df['fingerprint'].fillna("")
+    # Rows stamped size:mtime_ns:content_hash by earlier versions are converted, not re-extracted.
+    parts = df['fingerprint'].str.split(":", expand=False)
+    converted = parts.str.len() == 3
+    df.loc[converted, 'fingerprint'] = [fingerprint(*p) for p in parts[converted]]
+
+    # Rows written before fingerprints were recorded are trusted and stamped, not recomputed.
+    current = df['track_id'].map(expected)
+    legacy = df['fingerprint'] == ""
+    df.loc[legacy, 'fingerprint'] = current[legacy]
+
+    keep = current.notna() & ((current == "") | (df['fingerprint'] == current))
+    removed = df.loc[~keep, 'track_id']
+    if len(removed) or legacy.any() or converted.any():
+        store.write_table(df[keep], path)
+    if len(removed):
+        if bin_path:
+            rewrite_mfcc_vectors(set(df.loc[keep, 'track_id']), bin_path, ids_path)
+        logging.info("Removed %d stale tracks (deleted or changed files)", len(removed))
+
+    return set(df.loc[keep, 'track_id'])
+
+
+def load_mfcc_vectors(bin_path=MFCC_BIN, ids_path=MFCC_IDS):
+    # Returns (track_ids, float32 matrix); a re-extracted track keeps its latest row.
+    if not os.path.exists(ids_path):
+        return [], np.empty((0, MFCC_VECTOR_SIZE), dtype=np.float32)
+
+    with open(ids_path, encoding="utf-8") as f:
+        track_ids = f.read().splitlines()
+    vectors = np.fromfile(bin_path, dtype=np.float32)
+    vectors = vectors[:len(vectors) // MFCC_VECTOR_SIZE * MFCC_VECTOR_SIZE].reshape(-1, MFCC_VECTOR_SIZE)
+
+    # A crash mid-flush can leave one side longer than the other.
+    count = min(len(track_ids), len(vectors))
+    latest = {track_id: i for i, track_id in enumerate(track_ids[:count])}
+    return list(latest), vectors[list(latest.values())]
+
+
+def rewrite_mfcc_vectors(keep_ids, bin_path=MFCC_BIN, ids_path=MFCC_IDS):
+    # Compacts the MFCC sidecar down to keep_ids, swapping the new files into place.
+    track_ids, vectors = load_mfcc_vectors(bin_path, ids_path)
+    rows = [i for i, track_id in enumerate(track_ids) if track_id in keep_ids]
+
+    vectors[rows].tofile(bin_path + ".tmp")
+    with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+        f.writelines(f"{track_ids[i]}\n" for i in rows)
+    os.replace(bin_path + ".tmp", bin_path)
+    os.replace(ids_path + ".tmp", ids_path)
+
+
+def flush_rows(rows, path, bin_path=MFCC_BIN, ids_path=MFCC_IDS):
+    # Appends a batch of feature rows. MFCC vectors go first so every track in the table
+    # (the resume checkpoint) also has its vector.
+    with open(bin_path, "ab") as f:
+        np.stack([r.pop('mfcc_vector') for r in rows]).astype(np.float32).tofile(f)
+    with open(ids_path, "a", encoding="utf-8") as f:
+        f.writelines(f"{r['track_id']}\n" for r in rows)
+
+    df = pd.DataFrame(rows)
+    df = df[['track_id'] + [c for c in df.columns if c not in ('track_id', 'fingerprint')] + ['fingerprint']]
+    store.append_table(df, path)
+
+
+def write_feature_matrix(df, path=MATRIX_PATH, bin_path=MFCC_BIN, ids_path=MFCC_IDS, key_table=KEY_TABLE):
+    # Joins table scalars with MFCC vectors into one float32 row per track, in table order,
+    # keyed by int32 track key. Tracks the metadata scan has not keyed yet get keys here.
+    vector_ids, vectors = load_mfcc_vectors(bin_path, ids_path)
+    vector_row = {track_id: i for i, track_id in enumerate(vector_ids)}
+
+    df = df[df['track_id'].isin(vector_row)]
+    values = np.hstack([
+        df[MATRIX_SCALARS].to_numpy(np.float32),
+        vectors[[vector_row[track_id] for track_id in df['track_id']]],
+    ])
+
+    keys = TrackKeyIndex.load(key_table)
+    keys.add(df['track_id'])
+    if keys.dirty:
+        keys.save()
+
+    write_matrix(path, keys.keys(df['track_id']), MATRIX_SCALARS + MFCC_VECTOR_COLUMNS, values)
+    logging.info("Feature matrix: %d × %d → %s.npy", *values.shape, path)
+
+
+def load_metadata():
+    return store.load_metadata(OUTPUT_DIR)
+
+
+def expected_fingerprints(metadata_df, directory=OUTPUT_DIR):
+    # Current fingerprint per track_id, for sync_with_metadata; the first of colliding files wins.
+    fingerprints = file_fingerprints(directory)
+    expected = {}
+    for row in metadata_df.itertuples():
+        expected.setdefault(row.track_id, fingerprints.get(row.file_path, ""))
+    return expected
+
+
+def queue_tracks(metadata_df, done_ids):
+    # (track_id, file_path) tasks for the tracks not in done_ids, in metadata order.
+    tasks = []
+    queued = set()
+    for row in metadata_df.itertuples():
+        if row.track_id in done_ids:
+            continue
+
+        # Colliding track_ids would share one row (and MFCC vector); only the first is kept.
+        if row.track_id in queued:
+            logging.warning("Duplicate track_id %s, skipping: %s", row.track_id, row.file_path)
+            continue
+        queued.add(row.track_id)
+
+        if not os.path.exists(row.file_path):
+            logging.warning("File not found: %s", row.file_path)
             continue
 
-        logging.info("Processing: %s", file_path)
-        feats = extract_lowlevel(file_path)
+        tasks.append((row.track_id, row.file_path))
+
+    return tasks
+
+
+def pending_tracks(metadata_df, resume=True, quick=False):
+    # Returns (expected fingerprint per track_id, track_ids already up to date, (track_id,
+    # file_path) tasks to extract). Only tracks that are new, or whose file changed since
+    # extraction, are queued; a full (not quick) run also queues tracks with quick features.
+    if resume and store.table_exists(OUTPUT_TABLE):
+        df = store.read_table(OUTPUT_TABLE)
+        # A plugin registered since the last run has no values for the tracks already done.
+        missing = [c for c in PLUGIN_COLUMNS if c not in df.columns]
+        # Columns of a plugin removed since then are dropped, so new rows line up with old ones.
+        stale = [c for c in df.columns if c not in ['track_id'] + CORE_COLUMNS + PLUGIN_COLUMNS + ['resolution', 'fingerprint']]
+        if missing:
+            logging.info("Table has no %s, re-extracting every track", ", ".join(missing))
+            resume = False
+        elif stale or 'resolution' not in df:
+            if stale:
+                logging.info("Dropping %s from the table, no plugin computes them", ", ".join(stale))
+                df = df.drop(columns=stale)
+            if 'resolution' not in df:
+                # Tables from before quick mode hold full-resolution rows only.
+                df.insert(len(df.columns) - 1, 'resolution', "full")
+            store.write_table(df, OUTPUT_TABLE)
+    if not resume:
+        for path in (OUTPUT_TABLE, MFCC_BIN, MFCC_IDS):
+            store.remove_table(path)
+
+    expected = expected_fingerprints(metadata_df)
+    done_ids = sync_with_metadata(OUTPUT_TABLE, expected, MFCC_BIN, MFCC_IDS)
+    if done_ids and not quick:
+        # A quick row is superseded by the full row appended after it.
+        latest = store.read_table(OUTPUT_TABLE, columns=['track_id', 'resolution']).drop_duplicates('track_id', keep='last')
+        upgrade = set(latest.loc[latest['resolution'] == "quick", 'track_id'])
+        if upgrade:
+            logging.info("Upgrading %d tracks with quick features to full resolution", len(upgrade))
+            done_ids -= upgrade
+
+    return expected, done_ids, queue_tracks(metadata_df, done_ids)
+
+
+class RowWriter:
+    # Collects extracted rows and appends them every CHECKPOINT_BATCH tracks. Failed tracks
+    # (feats None) are never written, so the next run retries them.
+
+    def __init__(self, expected, resolution="full"):
+        self.expected = expected
+        self.resolution = resolution
+        self.batch = []
+        self.processed = 0
 
+    def add(self, track_id, feats):
         if feats:
             feats['track_id'] = track_id
-            all_features.append(feats)
-            processed += 1
-
-    if all_features:
-        df = pd.DataFrame(all_features)
-        df = df[['track_id'] + [c for c in df.columns if c != 'track_id']]
-        df.to_csv(OUTPUT_CSV, index=False)
-        logging.info("Done: %d tracks → %s", processed, OUTPUT_CSV)
-    else:
+            feats['resolution'] = self.resolution
+            feats['fingerprint'] = self.expected[track_id]
+            self.batch.append(feats)
+            self.processed += 1
+
+        if len(self.batch) >= CHECKPOINT_BATCH:
+            self.close()
+
+    def close(self):
+        if self.batch:
+            flush_rows(self.batch, OUTPUT_TABLE, MFCC_BIN, MFCC_IDS)
+            self.batch = []
+
+
+def open_writer(expected, resolution="full"):
+    return RowWriter(expected, resolution)
+
+
+def finish(metadata_df, processed):
+    if not store.table_exists(OUTPUT_TABLE):
         logging.warning("No features extracted!")
+        return
+
+    # Rows land in completion order; restore metadata order once the run is finished, keeping
+    # only the latest row of upgraded tracks.
+    df = store.read_table(OUTPUT_TABLE)
+    latest = df.drop_duplicates('track_id', keep='last')
+    if len(latest) < len(df):
+        # The MFCC sidecar holds the superseded vectors too; compact it along with the table.
+        rewrite_mfcc_vectors(set(latest['track_id']), MFCC_BIN, MFCC_IDS)
+        df = latest
+    df = store.in_metadata_order(df, metadata_df)
+    store.write_table(df, OUTPUT_TABLE)
+    logging.info("Done: %d new tracks, %d total → %s", processed, len(df), OUTPUT_TABLE)
+
+    write_feature_matrix(df, MATRIX_PATH, MFCC_BIN, MFCC_IDS, KEY_TABLE)
+
+    if EXPORT_CSV:
+        store.write_table(df, OUTPUT_CSV)
+        logging.info("Exported → %s", OUTPUT_CSV)
+
+
+def main(workers=WORKERS, resume=True, quick=False):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    metadata_df = load_metadata()
+
+    expected, done_ids, tasks = pending_tracks(metadata_df, resume, quick)
+    logging.info("Up to date: %d tracks, %d to extract with %d workers%s", len(done_ids), len(tasks), workers,
+                 " (quick)" if quick else "")
+
+    writer = open_writer(expected, "quick" if quick else "full")
+    for done, (track_id, feats) in enumerate(extract_parallel(tasks, workers, quick), 1):
+        logging.info("[%d/%d] Processed: %s", done, len(tasks), track_id)
+        writer.add(track_id, feats)
+    writer.close()
+
+    finish(metadata_df, writer.processed)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Low-level audio features for every track in the metadata")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-resume", dest="resume", action="store_false")
+    parser.add_argument("--quick", action="store_true", help="analyse excerpts of new tracks only; "
+                        "the next run without --quick upgrades them to full resolution")
+    args = parser.parse_args()
+    main(args.workers, args.resume, args.quick)
\ No newline at end of file
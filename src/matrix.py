@@ -0,0 +1,64 @@
+import os
+import json
+
+import numpy as np
+
+
+# Dense float32 track × feature matrices. Values live in <path>.npy (C order, so every row
+# is contiguous) and open read-only through np.memmap, letting many query processes share
+# the page cache instead of each holding a copy. The sidecar index is <path>.keys.npy, the
+# int32 track key of every row (see registry.TrackKeyIndex), plus column names in <path>.json.
+
+
+class FeatureMatrix:
+
+    def __init__(self, keys, columns, values, path=None):
+        self.keys = keys
+        self.columns = columns
+        self.values = values
+        # Where the matrix was opened from; None for matrices built in memory.
+        self.path = path
+        # Dense key → row lookup; -1 marks keys without a row.
+        self.row_of_key = np.full(int(keys.max()) + 1 if len(keys) else 0, -1, dtype=np.int64)
+        self.row_of_key[keys] = np.arange(len(keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rows(self, keys):
+        # Row indices for int track keys; raises KeyError for keys without a row.
+        keys = np.asarray(keys, dtype=np.int64)
+        known = (keys >= 0) & (keys < len(self.row_of_key))
+        rows = np.where(known, self.row_of_key[np.where(known, keys, 0)], -1)
+        if (rows < 0).any():
+            raise KeyError(f"Keys without a matrix row: {keys[rows < 0][:5].tolist()}")
+        return rows
+
+    def vectors(self, keys):
+        return self.values[self.rows(keys)]
+
+
+def write_matrix(path, keys, columns, values):
+    # Writes values and index beside the old ones, then swaps them into place.
+    values = np.ascontiguousarray(values, dtype=np.float32)
+    keys = np.asarray(keys, dtype=np.int32)
+    if values.shape != (len(keys), len(columns)):
+        raise ValueError(f"Matrix shape {values.shape} does not match {len(keys)} tracks × {len(columns)} columns")
+
+    for suffix, array in ((".npy", values), (".keys.npy", keys)):
+        with open(path + suffix + ".tmp", "wb") as f:
+            np.save(f, array)
+    with open(path + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump({"columns": list(columns)}, f)
+
+    for suffix in (".npy", ".keys.npy", ".json"):
+        os.replace(path + suffix + ".tmp", path + suffix)
+
+
+def open_matrix(path):
+    # Maps the matrix read-only; nothing is read from disk until rows are touched.
+    with open(path + ".json", encoding="utf-8") as f:
+        index = json.load(f)
+    values = np.load(path + ".npy", mmap_mode="r")
+    keys = np.load(path + ".keys.npy")
+    return FeatureMatrix(keys, index["columns"], values, path)
@@ -1,20 +1,69 @@
 import os
 import csv
 import re
-import unicodedata
+import time
+import hashlib
 import logging
 from pathlib import Path
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
 
 import ftfy
+import pandas as pd
 from mutagen import File as MutagenFile
 
+import store
+from registry import TrackIdRegistry, TrackKeyIndex
+
 
 INPUT_DIR = "Path"
 OUTPUT_DIR = "Path"
+OUTPUT_FORMAT = store.FORMAT
+OUTPUT_TABLE = store.table_path(OUTPUT_DIR, "metadata", OUTPUT_FORMAT)
+# Optional CSV copy alongside a columnar table, for the notebook and ad-hoc inspection.
+EXPORT_CSV = False
 OUTPUT_CSV = os.path.join(OUTPUT_DIR, "metadata.csv")
+# Per-file fingerprints of the last scan, used to re-read only new or changed files.
+FINGERPRINT_TABLE = store.table_path(OUTPUT_DIR, "fingerprints", OUTPUT_FORMAT)
+# Persistent file_path → track_id mapping that keeps IDs unique and stable across runs.
+REGISTRY_TABLE = store.table_path(OUTPUT_DIR, "track_ids", OUTPUT_FORMAT)
+# Dense int32 key per track_id, the join key for matrices, neighbor lists and caches.
+KEY_TABLE = store.table_path(OUTPUT_DIR, "track_keys", OUTPUT_FORMAT)
 
 AUDIO_EXTS = {".mp3", ".flac", ".wav", ".m4a", ".ogg", ".aac"}
 
+FIELDNAMES = [
+    "track_id",
+    "title",
+    "track_number",
+    "disc_number",
+    "duration_seconds",
+    "album",
+    "album_artist",
+    "contributing_artists",
+    "genre_tagged",
+    "year",
+    "file_path"
+]
+
+# Tag reads are I/O-latency bound (NAS), so threads overlap them well beyond the core count.
+SCAN_WORKERS = 16
+# Seconds between progress log lines during a scan.
+PROGRESS_INTERVAL = 10
+
+FINGERPRINT_FIELDS = ["file_path", "size", "mtime_ns", "content_hash"]
+# Also hash the first and last HASH_BYTES of files whose size/mtime changed, so files that were
+# only touched or copied are not re-parsed. Costs one extra read per changed file.
+HASH_FINGERPRINTS = False
+HASH_BYTES = 64 * 1024
+
+# Entries per normalizer cache. Album, artist and genre strings repeat across thousands of
+# files; titles rarely do, so this only needs to hold the repeating working set.
+NORMALIZE_CACHE_SIZE = 8192
+
+# Column types for the columnar table; year stays nullable.
+DTYPES = {"track_number": "int64", "disc_number": "int64", "duration_seconds": "int64", "year": "Int64"}
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,20 +71,33 @@ logging.basicConfig(
 )
 
 
-def clean_string(s: str | None) -> str | None: 
+# Dashes (U+2010-U+2014, U+2212) become "-"; zero-width characters, BOMs and "\r" are dropped.
+CLEAN_TABLE = str.maketrans(
+    {**dict.fromkeys("\u2010\u2011\u2012\u2013\u2014\u2212", "-"), **dict.fromkeys("\u200b\u200c\u200d\ufeff\r")}
+)
+
+FEAT_RE = re.compile(r"\b(ft\.?|feat\.?|featuring)\b\.?", re.IGNORECASE)
+ARTIST_SPLIT_RE = re.compile(r"[;,/&]")
+GENRE_SPLIT_RE = re.compile(r"[;,]")
+ID_STRIP_RE = re.compile(r"[^a-z0-9_-]")
+
+
+def clean_string(s: str | None) -> str | None:
     # Normalizes tag text across encodings and Unicode variants.
     if not s:
         return None
+    # Tag values may be unhashable Mutagen frames; the cache is keyed on their text.
+    return _clean_text(str(s))
 
-    s = ftfy.fix_text(str(s))
-    s = unicodedata.normalize("NFC", s)
 
-    s = re.sub(r"[‐-–—−]", "-", s)
-    s = s.replace("'", "'").replace("'", "'").replace(""", '"').replace(""", '"')
-    s = re.sub(r"[\u200B-\u200D\uFEFF]", "", s)
-    s = s.replace("\r", "")
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _clean_text(s: str) -> str:
+    # Printable ASCII without "&" (HTML entities) is something ftfy and the table leave alone.
+    if s.isascii() and s.isprintable() and "&" not in s:
+        return s.strip()
 
-    return s.strip()
+    # fix_text already returns NFC, so no separate normalization pass is needed.
+    return ftfy.fix_text(s).translate(CLEAN_TABLE).strip()
 
 
 def safe_get(tags: dict, keys: list[str]) -> str | None:
@@ -70,31 +132,35 @@ def parse_artists(raw: str | None) -> list[str] | None:
     # Normalizes artist strings and splits on common separators.
     if not raw:
         return None
+    artists = _parse_artists(str(raw))
+    return list(artists) if artists else None
 
-    raw = clean_string(raw)
 
-    raw = re.sub(
-        r"\b(ft\.?|feat\.?|featuring)\b\.?",
-        ";",
-        raw,
-        flags=re.IGNORECASE,
-    )
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _parse_artists(raw: str) -> tuple[str, ...]:
+    # Cached as a tuple so callers can never mutate a shared result.
+    raw = clean_string(raw)
 
-    artists = re.split(r"[;,/&]", raw)
-    artists = [clean_string(a) for a in artists if a.strip()]
+    raw = FEAT_RE.sub(";", raw)
 
-    return artists or None
+    artists = ARTIST_SPLIT_RE.split(raw)
+    return tuple(clean_string(a) for a in artists if a.strip())
 
 
 def parse_genres(raw: str | None) -> list[str] | None:
     # Splits genre tags while preserving semantic slashes.
     if not raw:
         return None
+    genres = _parse_genres(str(raw))
+    return list(genres) if genres else None
+
 
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _parse_genres(raw: str) -> tuple[str, ...]:
     raw = clean_string(raw)
 
     split_genres = []
-    for g in re.split(r"[;,]", raw):
+    for g in GENRE_SPLIT_RE.split(raw):
         split_genres.extend([s.strip() for s in g.split(" / ")])
 
     seen = set()
@@ -105,11 +171,19 @@ def parse_genres(raw: str | None) -> list[str] | None:
             deduped.append(g)
             seen.add(gl)
 
-    return deduped or None
+    return tuple(deduped)
+
+
+def log_cache_stats():
+    for name, cached in (("clean_string", _clean_text), ("parse_artists", _parse_artists), ("parse_genres", _parse_genres)):
+        info = cached.cache_info()
+        lookups = info.hits + info.misses
+        logging.info("%s cache: %d hits, %d misses (%.0f%% hit rate), %d/%d entries", name, info.hits,
+                     info.misses, 100 * info.hits / lookups if lookups else 0, info.currsize, info.maxsize)
 
 
 def sanitize_id(s: str) -> str:
-    return re.sub(r"[^a-z0-9_-]", "", s.lower())
+    return ID_STRIP_RE.sub("", s.lower())
 
 
 def generate_track_id(row: dict) -> str:
@@ -132,81 +206,235 @@ def generate_track_id(row: dict) -> str:
     return sanitize_id(raw_id)
 
 
-def extract_metadata() -> list[dict]:
-    rows = []
-    processed = 0
-
+def scan_audio_files() -> list[str]:
+    paths = []
     for root, _, files in os.walk(INPUT_DIR):
         for fname in files:
-            if Path(fname).suffix.lower() not in AUDIO_EXTS:
-                continue
-
-            path = os.path.join(root, fname)
-
-            try:
-                audio = MutagenFile(path, easy=False)
-                if not audio or not hasattr(audio, "info"):
-                    continue
-
-                tags = audio.tags or {}
-
-                artists_list = parse_artists(safe_get(tags, ["TPE1", "artist"]))
-                genres_list = parse_genres(safe_get(tags, ["TCON", "genre"]))
-
-                row = {
-                    "title": safe_get(tags, ["TIT2", "title"]),
-                    "track_number": parse_track_or_disc(safe_get(tags, ["TRCK", "tracknumber"])),
-                    "disc_number": parse_track_or_disc(safe_get(tags, ["TPOS", "discnumber"]), 1),
-                    "duration_seconds": int(round(audio.info.length)),
-                    "album": safe_get(tags, ["TALB", "album"]),
-                    "album_artist": safe_get(tags, ["TPE2", "albumartist"]),
-                    "contributing_artists": ";".join(artists_list) if artists_list else None,
-                    "genre_tagged": ";".join(genres_list) if genres_list else None,
-                    "year": parse_year(safe_get(tags, ["TDRC", "date", "YEAR"])),
-                    "file_path": path,
-                }
-
-                row["track_id"] = generate_track_id(row)
-                rows.append(row)
-                processed += 1
+            if Path(fname).suffix.lower() in AUDIO_EXTS:
+                paths.append(os.path.join(root, fname))
+    return paths
+
+
+def read_metadata(path: str) -> dict | None:
+    # Reads and normalizes the tags of one file; None if it is not readable audio.
+    try:
+        audio = MutagenFile(path, easy=False)
+        if not audio or not hasattr(audio, "info"):
+            return None
+
+        tags = audio.tags or {}
+
+        artists_list = parse_artists(safe_get(tags, ["TPE1", "artist"]))
+        genres_list = parse_genres(safe_get(tags, ["TCON", "genre"]))
+
+        row = {
+            "title": safe_get(tags, ["TIT2", "title"]),
+            "track_number": parse_track_or_disc(safe_get(tags, ["TRCK", "tracknumber"])),
+            "disc_number": parse_track_or_disc(safe_get(tags, ["TPOS", "discnumber"]), 1),
+            "duration_seconds": int(round(audio.info.length)),
+            "album": safe_get(tags, ["TALB", "album"]),
+            "album_artist": safe_get(tags, ["TPE2", "albumartist"]),
+            "contributing_artists": ";".join(artists_list) if artists_list else None,
+            "genre_tagged": ";".join(genres_list) if genres_list else None,
+            "year": parse_year(safe_get(tags, ["TDRC", "date", "YEAR"])),
+            "file_path": path,
+        }
+
+        row["track_id"] = generate_track_id(row)
+        return row
+
+    except Exception:
+        logging.exception("Failed processing file: %s", path)
+        return None
+
+
+def log_progress(done: int, total: int, started: float):
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed else 0.0
+    eta = (total - done) / rate if rate else 0.0
+    logging.info("Scanned %d/%d files (%.0f%%), %.1f files/s, ETA %.0fs",
+                 done, total, 100 * done / total if total else 100, rate, eta)
+
+
+def content_hash(path: str) -> str:
+    # Cheap content hash from the size and the first/last HASH_BYTES of the file.
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_BYTES))
+        if size > HASH_BYTES:
+            f.seek(max(HASH_BYTES, size - HASH_BYTES))
+            digest.update(f.read(HASH_BYTES))
+    return digest.hexdigest()
 
-                if processed % 500 == 0:
-                    logging.info("Processed %d tracks", processed)
 
-            except Exception:
-                logging.exception("Failed processing file: %s", path)
+def file_fingerprint(path: str, previous: dict | None = None) -> dict:
+    st = os.stat(path)
+    fp = {"file_path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "content_hash": ""}
 
-    logging.info("Finished extraction: %d tracks", processed)
+    if HASH_FINGERPRINTS:
+        if previous and previous["content_hash"] and (previous["size"], previous["mtime_ns"]) == (fp["size"], fp["mtime_ns"]):
+            fp["content_hash"] = previous["content_hash"]
+        else:
+            fp["content_hash"] = content_hash(path)
+
+    return fp
+
+
+def fingerprint_unchanged(fp: dict, previous: dict | None) -> bool:
+    if previous is None or fp["size"] != previous["size"]:
+        return False
+    if fp["mtime_ns"] == previous["mtime_ns"]:
+        return True
+    return bool(fp["content_hash"]) and fp["content_hash"] == previous["content_hash"]
+
+
+def _records(df: pd.DataFrame) -> list[dict]:
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def load_previous_scan() -> tuple[dict, dict]:
+    # Rows and fingerprints of the last scan, keyed by file_path; empty on the first run.
+    if not (store.table_exists(OUTPUT_TABLE) and store.table_exists(FINGERPRINT_TABLE)):
+        return {}, {}
+
+    rows = _records(store.read_table(OUTPUT_TABLE).astype(DTYPES))
+    fingerprints = store.read_table(FINGERPRINT_TABLE)
+    fingerprints["content_hash"] = fingerprints["content_hash"].fillna("")
+    return {r["file_path"]: r for r in rows}, {f["file_path"]: f for f in _records(fingerprints)}
+
+
+def keep_previous(path: str, previous_rows: dict, previous_fingerprints: dict) -> dict | None:
+    # The last scan's row for a file that was found but couldn't be read this time (a NAS
+    # timeout, a file mid-copy), with its old fingerprint so the next scan reads it again.
+    if path in previous_rows and path in previous_fingerprints:
+        logging.warning("Keeping the previous row of %s", path)
+        return {**previous_rows[path], **previous_fingerprints[path]}
+    return None
+
+
+def scan_file(path: str, previous_rows: dict, previous_fingerprints: dict) -> tuple[dict | None, bool]:
+    # Returns (row with fingerprint fields, whether tags were re-read).
+    # Files that vanish or can't be read mid-scan (broken symlinks, permissions) keep their
+    # previous row if they have one and are skipped otherwise.
+    previous = previous_fingerprints.get(path)
+    try:
+        fp = file_fingerprint(path, previous)
+    except Exception:
+        logging.exception("Failed processing file: %s", path)
+        return keep_previous(path, previous_rows, previous_fingerprints), False
+
+    if path in previous_rows and fingerprint_unchanged(fp, previous):
+        return {**previous_rows[path], **fp}, False
+
+    row = read_metadata(path)
+    if row is None:
+        return keep_previous(path, previous_rows, previous_fingerprints), False
+    return {**row, **fp}, True
+
+
+def load_registry() -> TrackIdRegistry:
+    # The first run with a registry adopts the IDs of the existing metadata table.
+    seed_rows = []
+    if not store.table_exists(REGISTRY_TABLE) and store.table_exists(OUTPUT_TABLE):
+        seed_rows = _records(store.read_table(OUTPUT_TABLE, columns=["file_path", "track_id"]))
+    return TrackIdRegistry.load(REGISTRY_TABLE, seed_rows)
+
+
+def assign_track_ids(rows: list[dict], paths: list[str]):
+    # Replaces each row's base ID with its registered one. New paths are assigned in path
+    # order, so collision suffixes do not depend on walk or thread scheduling order. Only
+    # paths missing from the walk are retired; a file that was found but failed to read
+    # keeps its ID.
+    registry = load_registry()
+    for row in sorted((r for r in rows if r["file_path"] not in registry), key=lambda r: r["file_path"]):
+        registry.assign(row["file_path"], row["track_id"])
+    for row in rows:
+        row["track_id"] = registry.by_path[row["file_path"]]
+
+    registry.retain(paths)
+    registry.save()
+    registry.log_stats()
+
+    keys = TrackKeyIndex.load(KEY_TABLE)
+    known = len(keys)
+    keys.add(r["track_id"] for r in rows)
+    if keys.dirty:
+        keys.save()
+    logging.info("track keys: %d issued, %d new this run", len(keys), len(keys) - known)
+
+
+def extract_metadata(workers: int = SCAN_WORKERS, incremental: bool = True) -> list[dict]:
+    # Reads tags on a thread pool; map() yields rows in walk order, same as a serial scan.
+    # Incremental scans reuse rows of files whose fingerprint is unchanged since the last run.
+    paths = scan_audio_files()
+    previous_rows, previous_fingerprints = load_previous_scan() if incremental else ({}, {})
+    logging.info("Found %d audio files, scanning with %d threads", len(paths), workers)
+
+    rows = []
+    added = changed = unchanged = 0
+    started = last_report = time.monotonic()
+    scan = partial(scan_file, previous_rows=previous_rows, previous_fingerprints=previous_fingerprints)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for done, (path, (row, parsed)) in enumerate(zip(paths, pool.map(scan, paths)), 1):
+            if row:
+                rows.append(row)
+                if not parsed:
+                    unchanged += 1
+                elif path in previous_rows:
+                    changed += 1
+                else:
+                    added += 1
+
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                log_progress(done, len(paths), started)
+                last_report = time.monotonic()
+
+    removed = len(previous_rows.keys() - set(paths))
+    log_progress(len(paths), len(paths), started)
+    logging.info("Delta since last scan: %d added, %d changed, %d removed, %d unchanged",
+                 added, changed, removed, unchanged)
+    log_cache_stats()
+    assign_track_ids(rows, paths)
+    logging.info("Finished extraction: %d tracks", len(rows))
     return rows
 
 
 def write_csv(rows: list[dict]):
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    fieldnames = [
-        "track_id",
-        "title",
-        "track_number",
-        "disc_number",
-        "duration_seconds",
-        "album",
-        "album_artist",
-        "contributing_artists",
-        "genre_tagged",
-        "year",
-        "file_path"
-    ]
-
     with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
         writer.writeheader()
         for r in rows:
             # CSV requires empty fields rather than None.
-            safe_row = {k: (r.get(k) if r.get(k) is not None else "") for k in fieldnames}
+            safe_row = {k: (r.get(k) if r.get(k) is not None else "") for k in FIELDNAMES}
             writer.writerow(safe_row)
 
 
+def write_metadata(rows: list[dict]):
+    # Writes the typed metadata table; the CSV format keeps the legacy writer.
+    if OUTPUT_FORMAT == "csv":
+        write_csv(rows)
+    else:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        df = pd.DataFrame(rows, columns=FIELDNAMES).astype(DTYPES)
+        store.write_table(df, OUTPUT_TABLE)
+
+    # Fingerprints go last: a crash in between leaves them older than the table, which only
+    # means some files are re-read next time.
+    write_fingerprints(rows)
+
+
+def write_fingerprints(rows: list[dict]):
+    df = pd.DataFrame(rows, columns=FINGERPRINT_FIELDS).astype({"size": "int64", "mtime_ns": "int64"})
+    store.write_table(df, FINGERPRINT_TABLE)
+
+
 if __name__ == "__main__":
     data = extract_metadata()
-    write_csv(data)
-    logging.info("Extracted metadata for %d tracks → %s", len(data), OUTPUT_CSV)
\ No newline at end of file
+    write_metadata(data)
+    if EXPORT_CSV:
+        write_csv(data)
+    logging.info("Extracted metadata for %d tracks → %s", len(data), OUTPUT_TABLE)
@@ -0,0 +1,240 @@
+import os
+import json
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import store
+from registry import TrackKeyIndex
+from similarity import SimilarityEngine, METRICS, MATRIX_PATH, KEY_TABLE, QUERY_BLOCK
+
+
+OUTPUT_DIR = "Path"
+NEIGHBORS_DIR = os.path.join(OUTPUT_DIR, "lowlevel_neighbors")
+
+TOP_K = 50
+METRIC = "cosine"
+# Worker processes for the blocked search; 1 runs everything in-process.
+WORKERS = os.cpu_count() or 1
+# Seed rows per worker task, searched a block of seeds at a time inside the worker.
+TASK_ROWS = 8192
+# Memory all workers together may spend on seed × catalogue distance blocks. The seed block
+# is sized from it and the catalogue, so a 1M-track catalogue gets small blocks instead of
+# QUERY_BLOCK × 1M per worker.
+SEARCH_BYTES = 4 * 2 ** 30
+# Bytes per seed × track pair at the peak of a block: float32 products and distances, their
+# temporaries and argpartition's int64 indices.
+PAIR_BYTES = 24
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+def row_digests(values):
+    # 64-bit digest of every feature row; a changed digest means the track was re-extracted.
+    # 0 is reserved for "no row", so a (vanishingly unlikely) zero digest is bumped to 1.
+    digests = np.array([int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), "little", signed=True)
+                        for row in np.asarray(values, dtype=np.float32)], dtype=np.int64)
+    digests[digests == 0] = 1
+    return digests
+
+
+class NeighborTable:
+    # Top-k neighbors of every track, indexed by int32 track key: row `key` of neighbors.npy
+    # holds the neighbor keys nearest first (-1 padded) and the same row of distances.npy
+    # their float16 distances. digests.npy records the feature row each list was computed
+    # from (0 for keys without a list), and scale.npy the standardization, which refreshes
+    # reuse so old and new distances stay comparable.
+
+    def __init__(self, metric, k, scale, neighbors, distances, digests):
+        self.metric = metric
+        self.k = k
+        self.scale = scale
+        self.neighbors = neighbors
+        self.distances = distances
+        self.digests = digests
+
+    @classmethod
+    def empty(cls, metric, k, scale, size):
+        return cls(metric, k, scale,
+                   np.full((size, k), -1, dtype=np.int32),
+                   np.full((size, k), np.inf, dtype=np.float16),
+                   np.zeros(size, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.digests)
+
+    def grow(self, size):
+        # Extends the table to hold keys below size; new rows start empty.
+        extra = size - len(self)
+        if extra > 0:
+            self.neighbors = np.vstack([self.neighbors, np.full((extra, self.k), -1, dtype=np.int32)])
+            self.distances = np.vstack([self.distances, np.full((extra, self.k), np.inf, dtype=np.float16)])
+            self.digests = np.concatenate([self.digests, np.zeros(extra, dtype=np.int64)])
+
+    def clear(self, keys):
+        self.neighbors[keys] = -1
+        self.distances[keys] = np.inf
+        self.digests[keys] = 0
+
+    def put(self, keys, neighbors, distances, digests):
+        # Stores lists for keys; lists shorter than k (tiny catalogues) are padded.
+        width = neighbors.shape[1]
+        self.clear(keys)
+        self.neighbors[keys, :width] = neighbors
+        self.distances[keys, :width] = distances
+        self.digests[keys] = digests
+
+    def lookup(self, key):
+        # Neighbor keys and distances of one track, nearest first.
+        found = self.neighbors[key] >= 0
+        return self.neighbors[key][found], self.distances[key][found].astype(np.float32)
+
+    def save(self, path):
+        with store.replacing_dir(path) as tmp:
+            np.save(os.path.join(tmp, "neighbors.npy"), self.neighbors)
+            np.save(os.path.join(tmp, "distances.npy"), self.distances)
+            np.save(os.path.join(tmp, "digests.npy"), self.digests)
+            np.save(os.path.join(tmp, "scale.npy"), np.stack(self.scale))
+            with open(os.path.join(tmp, "table.json"), "w", encoding="utf-8") as f:
+                json.dump({"metric": self.metric, "k": self.k}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        # Memory-mapped read-only by default; refresh loads a writable copy with mmap_mode=None.
+        with open(os.path.join(path, "table.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+                  for name in ("neighbors", "distances", "digests")]
+        mean, std = np.load(os.path.join(path, "scale.npy"))
+        return cls(meta["metric"], meta["k"], (mean, std), *arrays)
+
+
+_engine = None
+
+
+def _init_worker(matrix_path, key_table, metric, scale):
+    # Workers map the standardized vectors the parent engine already wrote.
+    global _engine
+    _engine = SimilarityEngine.load(matrix_path, key_table, metric, scale)
+
+
+def seed_block(tracks, workers, budget=SEARCH_BYTES):
+    # Seeds per distance block, so workers × block × tracks pairs fit in the budget.
+    return int(np.clip(budget // (max(workers, 1) * max(tracks, 1) * PAIR_BYTES), 1, QUERY_BLOCK))
+
+
+def _search_task(rows, k, block):
+    return (rows,) + _engine.search(rows, k, block)
+
+
+def search_parallel(engine, rows, k, workers, matrix_path, key_table):
+    # Exact top-k for seed rows, fanned out over worker processes in TASK_ROWS chunks.
+    chunks = [rows[i:i + TASK_ROWS] for i in range(0, len(rows), TASK_ROWS)]
+    if workers <= 1 or len(chunks) <= 1:
+        block = seed_block(len(engine), 1)
+        for chunk in chunks:
+            yield (chunk,) + engine.search(chunk, k, block)
+        return
+
+    block = seed_block(len(engine), workers)
+    logging.info("Searching %d seeds per block in %d workers", block, workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(matrix_path, key_table, engine.metric, engine.scale)) as pool:
+        yield from pool.map(_search_task, chunks, [k] * len(chunks), [block] * len(chunks))
+
+
+def merge_fresh(engine, table, keys, fresh_rows, block=4096):
+    # Folds newly added tracks into the existing lists of keys: each list only needs the
+    # distances to the fresh tracks, not a search over the whole catalogue. Returns how
+    # many lists changed.
+    fresh_keys = engine.matrix.keys[fresh_rows].astype(np.int32)
+    changed = 0
+    for start in range(0, len(keys), block):
+        block_keys = keys[start:start + block]
+        d = engine.distances(engine.matrix.rows(block_keys), fresh_rows)
+
+        candidates = np.hstack([table.neighbors[block_keys], np.broadcast_to(fresh_keys, d.shape)])
+        candidate_d = np.hstack([table.distances[block_keys].astype(np.float32), d])
+        top = np.argsort(candidate_d, axis=1, kind="stable")[:, :table.k]
+        neighbors = np.take_along_axis(candidates, top, axis=1)
+        distances = np.take_along_axis(candidate_d, top, axis=1)
+
+        changed += int((neighbors != table.neighbors[block_keys]).any(axis=1).sum())
+        table.neighbors[block_keys] = np.where(np.isfinite(distances), neighbors, -1)
+        table.distances[block_keys] = distances
+    return changed
+
+
+def refresh(matrix_path=MATRIX_PATH, key_table=KEY_TABLE, path=NEIGHBORS_DIR, k=TOP_K, metric=METRIC,
+            workers=WORKERS, full=False):
+    # Brings the neighbor table in line with the feature matrix. Lists are recomputed only
+    # for new or re-extracted tracks and for tracks whose list held a removed or changed
+    # one; every other list just merges in the new tracks. A different k, metric or
+    # feature layout, or full=True, recomputes everything with a fresh standardization.
+    table = NeighborTable.load(path, mmap_mode=None) if os.path.exists(path) else None
+    if table is not None and (table.k != k or table.metric != metric):
+        logging.info("Neighbor table has k=%d %s, rebuilding for k=%d %s", table.k, table.metric, k, metric)
+        full = True
+    engine = SimilarityEngine.load(matrix_path, key_table, metric, None if full or table is None else table.scale)
+    if table is not None and len(table.scale[0]) != engine.vectors.shape[1]:
+        logging.info("Feature layout changed, rebuilding neighbor table")
+        full = True
+        engine = SimilarityEngine.load(matrix_path, key_table, metric)
+
+    keys = engine.matrix.keys
+    digests = row_digests(engine.matrix.values)
+    size = int(keys.max()) + 1 if len(keys) else 0
+
+    if full or table is None:
+        table = NeighborTable.empty(metric, k, engine.scale, size)
+    table.grow(size)
+
+    current = np.zeros(len(table), dtype=np.int64)
+    current[keys] = digests
+    stale = (table.digests != 0) & (table.digests != current)
+    fresh = (current != 0) & (table.digests != current)
+    listed = table.neighbors >= 0
+    lost_neighbor = (stale[np.where(listed, table.neighbors, 0)] & listed).any(axis=1) & (current != 0)
+    recompute = fresh | lost_neighbor
+
+    table.clear(stale)
+    merge = np.flatnonzero((current != 0) & ~recompute)
+    fresh_rows = engine.matrix.rows(np.flatnonzero(fresh))
+    changed = merge_fresh(engine, table, merge, fresh_rows) if len(merge) and len(fresh_rows) else 0
+
+    rows = engine.matrix.rows(np.flatnonzero(recompute))
+    for seed_rows, neighbor_rows, distances in search_parallel(engine, rows, k, workers, matrix_path, key_table):
+        seed_keys = keys[seed_rows]
+        table.put(seed_keys, keys[neighbor_rows], distances, current[seed_keys])
+
+    table.save(path)
+    logging.info("Neighbor table: %d tracks, %d new or changed, %d removed, %d recomputed, %d kept (%d gained new neighbors) → %s",
+                 len(keys), int(fresh.sum()), int((stale & (current == 0)).sum()), len(rows), len(merge), changed, path)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precomputed top-k neighbors of every track")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("refresh", help="update the neighbor table from the lowlevel matrix")
+    build.add_argument("-k", type=int, default=TOP_K)
+    build.add_argument("--metric", choices=METRICS, default=METRIC)
+    build.add_argument("--workers", type=int, default=WORKERS)
+    build.add_argument("--full", action="store_true", help="recompute every list and the standardization")
+
+    query = commands.add_parser("query", help="stored neighbors of seed track_ids")
+    query.add_argument("track_ids", nargs="+")
+
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        refresh(k=args.k, metric=args.metric, workers=args.workers, full=args.full)
+    else:
+        table, track_keys = NeighborTable.load(NEIGHBORS_DIR), TrackKeyIndex.load(KEY_TABLE)
+        for track_id, key in zip(args.track_ids, track_keys.keys(args.track_ids)):
+            found, distances = table.lookup(key)
+            print(track_id, list(zip(track_keys.ids(found), np.round(distances, 4))))
@@ -0,0 +1,134 @@
+import os
+import hashlib
+import logging
+
+import numpy as np
+
+
+OUTPUT_DIR = "Path"
+# Decoded mono PCM per track, so re-running extraction after a feature change
+# skips decoding. Off by default; it trades disk for decode time.
+PCM_CACHE = False
+PCM_CACHE_DIR = os.path.join(OUTPUT_DIR, "pcm_cache")
+# Size budget; least recently used entries are deleted once the cache grows past it.
+PCM_CACHE_BYTES = 50 * 2 ** 30
+# "int16" and "float16" are lossy, a 44.1 kHz minute in ~5 MB. Decoded signals aren't 16-bit
+# exact (stereo is averaged to mono in half steps, MP3 and resampled sources are continuous),
+# so features from cached audio drift slightly; float16 keeps relative precision in very
+# quiet passages. "float32" stores the decoded signal bit for bit at twice the size, for
+# runs that need features identical to a fresh decode.
+PCM_DTYPE = "int16"
+# Eviction trims the cache to this fraction of the budget, so it doesn't run on every write.
+EVICT_TO = 0.9
+# Processes sharing the cache; each rescans the directory once it has written its share of
+# the headroom below EVICT_TO left at its last scan, so together they can't overshoot the
+# budget. Near the budget that share is 0 and every write rescans.
+WORKERS = os.cpu_count() or 1
+
+# Decoders map 16-bit samples to x / 32768.
+INT16_SCALE = 32768
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+class PCMCache:
+    # One .npy file per (track_id, sample rate, source file version). Entries are named after
+    # the file's size and mtime, so an edited file is decoded again instead of hitting a stale
+    # entry; the stale one ages out. Reads memory-map the file and bump its mtime, which is
+    # what eviction orders by. Worker processes share the directory: each writes under a
+    # private temporary name and renames into place, and eviction tolerates files another
+    # worker removed first. Eviction decisions are based on the real directory total, never
+    # on one process's own writes.
+
+    def __init__(self, directory=PCM_CACHE_DIR, budget=PCM_CACHE_BYTES, dtype=PCM_DTYPE, workers=WORKERS):
+        if dtype not in ("int16", "float16", "float32"):
+            raise ValueError(f"Unknown PCM cache dtype: {dtype}")
+        self.directory = directory
+        self.budget = budget
+        self.dtype = np.dtype(dtype)
+        self.workers = workers
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        # Directory total, and the bytes this process may write before scanning again.
+        self.size = sum(size for _, size, _ in self._entries())
+        self.allowance = max(self.budget * EVICT_TO - self.size, 0) / self.workers
+        self.written = 0
+
+    def _entries(self):
+        # (path, bytes, last use) of every entry on disk.
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def path(self, track_id, file_path, rate):
+        stat = os.stat(file_path)
+        version = hashlib.blake2b(f"{file_path}|{stat.st_size}|{stat.st_mtime_ns}".encode(), digest_size=4).hexdigest()
+        return os.path.join(self.directory, f"{track_id}.{rate}.{version}.npy")
+
+    def get(self, track_id, file_path, rate):
+        # The cached float32 signal, or None on a miss.
+        path = self.path(track_id, file_path, rate)
+        try:
+            pcm = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        if pcm.dtype == np.int16:
+            return pcm.astype(np.float32) / INT16_SCALE
+        return pcm.astype(np.float32)
+
+    def put(self, track_id, file_path, rate, signal):
+        path = self.path(track_id, file_path, rate)
+        if self.dtype == np.int16:
+            pcm = np.clip(np.round(signal * INT16_SCALE), -INT16_SCALE, INT16_SCALE - 1).astype(np.int16)
+        else:
+            pcm = signal.astype(self.dtype)
+
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, pcm)
+        os.replace(tmp, path)
+
+        self.written += os.path.getsize(path)
+        if self.written >= self.allowance:
+            self.scan()
+            if self.size > self.budget:
+                self.evict()
+
+    def evict(self):
+        # Deletes least recently used entries until the cache is within EVICT_TO of the budget.
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if self.size <= self.budget * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            removed += 1
+        self.allowance = max(self.budget * EVICT_TO - self.size, 0) / self.workers
+        self.written = 0
+        logging.info("PCM cache: evicted %d entries, %.1f GiB kept", removed, self.size / 2 ** 30)
+
+
+# One cache per process, opened on first use.
+_cache = None
+
+
+def shared_cache():
+    # The process's PCMCache, or None when PCM_CACHE is off.
+    global _cache
+    if PCM_CACHE and _cache is None:
+        _cache = PCMCache()
+    return _cache
@@ -0,0 +1,103 @@
+import os
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import highlevel
+import lowlevel
+from decode import DecodedTrack
+from pcmcache import shared_cache
+
+
+# Extraction stages fed from a single decode per track. A stage module provides
+# SAMPLE_RATE, make_extractor() (an object with compute(audio)), pending_tracks(metadata_df,
+# resume), open_writer(expected) and finish(metadata_df, processed). A new stage (rhythm,
+# tonal, ...) is one more entry here and never another decode.
+STAGES = {"lowlevel": lowlevel, "highlevel": highlevel}
+# Stages run when none are named: highlevel only with an Essentia build that can run its
+# models, so the other stages work out of the box.
+DEFAULT_STAGES = [name for name in STAGES if name != "highlevel" or highlevel.TENSORFLOW]
+
+WORKERS = os.cpu_count() or 1
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+# Stage extractors per process, built on first use inside each worker.
+_extractors = {}
+
+
+def _decode_task(task):
+    # Decodes one file and runs every stage that still needs it. A stage's result is None if
+    # the decode or that stage failed, so only the failed stages retry on the next run.
+    track_id, file_path, names = task
+    track = DecodedTrack(file_path, track_id, shared_cache())
+    try:
+        track.at()
+    except Exception as e:
+        logging.error("Failed loading %s: %s", file_path, e)
+        return track_id, dict.fromkeys(names)
+
+    results = {}
+    for name in names:
+        stage = STAGES[name]
+        if name not in _extractors:
+            _extractors[name] = stage.make_extractor()
+        try:
+            results[name] = _extractors[name].compute(track.at(stage.SAMPLE_RATE))
+        except Exception as e:
+            logging.error("%s failed on %s: %s", name, file_path, e)
+            results[name] = None
+    return track_id, results
+
+
+def decode_parallel(tasks, workers=WORKERS):
+    # Fans (track_id, file_path, stages) tasks out to worker processes, yielding results as they complete.
+    if workers <= 1:
+        for task in tasks:
+            yield _decode_task(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_decode_task, task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(stages=None, workers=WORKERS, resume=True):
+    if not stages and not highlevel.TENSORFLOW:
+        logging.warning("Skipping highlevel: this Essentia build has no TensorFlow support (pip install essentia-tensorflow)")
+    names = list(stages or DEFAULT_STAGES)
+    metadata_df = lowlevel.load_metadata()
+
+    # Each track is queued once, tagged with every stage that is missing it.
+    pending, writers = {}, {}
+    for name in names:
+        stage = STAGES[name]
+        expected, done_ids, tasks = stage.pending_tracks(metadata_df, resume)
+        logging.info("%s: %d tracks up to date, %d to extract", name, len(done_ids), len(tasks))
+        for task in tasks:
+            pending.setdefault(task, []).append(name)
+        writers[name] = stage.open_writer(expected)
+
+    tasks = [(track_id, file_path, stage_names) for (track_id, file_path), stage_names in pending.items()]
+    logging.info("Decoding %d tracks once for %s with %d workers", len(tasks), ", ".join(names), workers)
+
+    for done, (track_id, results) in enumerate(decode_parallel(tasks, workers), 1):
+        logging.info("[%d/%d] Processed: %s", done, len(tasks), track_id)
+        for name, result in results.items():
+            writers[name].add(track_id, result)
+
+    for name in names:
+        writers[name].close()
+        STAGES[name].finish(metadata_df, writers[name].processed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run every feature extraction stage from one decode per track")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=None,
+                        help=f"default: {' '.join(DEFAULT_STAGES)}")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-resume", dest="resume", action="store_false")
+    args = parser.parse_args()
+    main(args.stages, args.workers, args.resume)
@@ -0,0 +1,80 @@
+import numpy as np
+
+from stats import RunningStats
+
+
+# Per-frame inputs a plugin can ask the lowlevel runner for. The runner frames the signal,
+# windows each frame and takes its magnitude spectrum once, then hands the same block
+# arrays to every plugin, so a plugin costs only its own math.
+WAVEFORM = "waveform"   # the whole mono signal, passed to start()
+FRAME = "frame"         # raw frames, (frames, frame_size)
+WINDOWED = "windowed"   # hann-windowed frames, (frames, frame_size)
+SPECTRUM = "spectrum"   # magnitude spectra of the windowed frames, (frames, frame_size // 2 + 1)
+
+
+class FeaturePlugin:
+    # One group of lowlevel features. A plugin is built once per extractor, start() resets it
+    # for each track, update() sees one block of up to FRAME_BLOCK frames at a time, and
+    # summary() returns the track's values for the names in `columns`. Inputs not listed in
+    # `needs` are passed as None and never computed for this plugin's sake.
+
+    needs = ()
+    columns = []
+
+    def __init__(self, sample_rate=44100, frame_size=2048):
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+
+    def start(self, audio):
+        pass
+
+    def update(self, frames, windowed, spectra):
+        pass
+
+    def summary(self):
+        return {}
+
+
+class FrameStatistic(FeaturePlugin):
+    # A plugin reducing every frame to one value, reported as the track's mean and std.
+    # Subclasses implement values(frames, windowed, spectra).
+
+    def start(self, audio):
+        self.stats = RunningStats()
+
+    def update(self, frames, windowed, spectra):
+        self.stats.update(self.values(frames, windowed, spectra))
+
+    def summary(self):
+        mean_column, std_column = self.columns
+        return {mean_column: float(self.stats.mean), std_column: float(self.stats.std())}
+
+
+class SpectralRolloff(FrameStatistic):
+    # Frequency below which `cutoff` of the frame's spectral energy lies; matches
+    # es.RollOff (0 Hz for a silent frame).
+
+    needs = (SPECTRUM,)
+    columns = ['spectral_rolloff_mean', 'spectral_rolloff_std']
+
+    def __init__(self, sample_rate=44100, frame_size=2048, cutoff=0.85):
+        super().__init__(sample_rate, frame_size)
+        self.cutoff = cutoff
+
+    def values(self, frames, windowed, spectra):
+        energy = np.cumsum(spectra.astype(np.float64) ** 2, axis=1)
+        # Index of the first bin where the cumulative energy reaches the cutoff.
+        bins = (energy < self.cutoff * energy[:, -1:]).sum(axis=1)
+        return bins * (self.sample_rate / 2) / (spectra.shape[1] - 1)
+
+
+class ZeroCrossingRate(FrameStatistic):
+    # Sign changes per sample of the raw frame; like es.ZeroCrossingRate, a zero sample
+    # counts as negative.
+
+    needs = (FRAME,)
+    columns = ['zcr_mean', 'zcr_std']
+
+    def values(self, frames, windowed, spectra):
+        positive = frames > 0
+        return np.count_nonzero(positive[:, 1:] != positive[:, :-1], axis=1) / frames.shape[1]
@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+
+from cluster import kmeans
+
+
+# Compressed storage for track vectors. Codes are what the index keeps in memory; queries
+# stay float32 and are compared against the codes directly (asymmetric distance), so only
+# the stored side loses precision. A quantizer scores codes with
+# distances(prepare(query), codes), where prepare does the per-query work once.
+
+# Bytes per PQ code; None picks one byte per PQ_DIMS dimensions.
+PQ_SUBSPACES = None
+PQ_DIMS = 4
+PQ_CENTROIDS = 256
+# Training points per PQ centroid. Each subspace trains its own codebook, so this is kept
+# well below cluster.KMEANS_SAMPLE.
+PQ_SAMPLE = 64
+
+
+def _distances(query, vectors, metric):
+    # Same distances as SimilarityEngine: 1 - dot product of unit vectors, or Euclidean.
+    if metric == "cosine":
+        return 1.0 - vectors @ query
+    return np.sqrt(np.maximum(((vectors - query) ** 2).sum(axis=1), 0.0))
+
+
+class ScalarQuantizer:
+    # int8 scalar quantization: each dimension is mapped linearly from its trained
+    # [low, high] range onto 256 levels. 4× smaller than float32 with little recall loss.
+
+    name = "int8"
+
+    def __init__(self, metric, low, scale):
+        self.metric = metric
+        self.low = low
+        self.scale = scale
+
+    @classmethod
+    def train(cls, vectors, metric):
+        low = vectors.min(axis=0)
+        scale = (vectors.max(axis=0) - low) / 255.0
+        scale[scale == 0] = 1.0
+        return cls(metric, low.astype(np.float32), scale.astype(np.float32))
+
+    @property
+    def code_size(self):
+        return len(self.low)
+
+    def encode(self, vectors):
+        levels = np.rint((vectors - self.low) / self.scale)
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def decode(self, codes):
+        return (codes.astype(np.float32) + 128) * self.scale + self.low
+
+    def prepare(self, query):
+        return query
+
+    def distances(self, query, codes):
+        # Codes are decoded block by block; the query itself is never quantized.
+        return _distances(query, self.decode(codes), self.metric)
+
+    def save(self, path):
+        np.save(os.path.join(path, "sq_low.npy"), self.low)
+        np.save(os.path.join(path, "sq_scale.npy"), self.scale)
+
+    @classmethod
+    def load(cls, path, metric, dims):
+        return cls(metric, np.load(os.path.join(path, "sq_low.npy")), np.load(os.path.join(path, "sq_scale.npy")))
+
+
+class ProductQuantizer:
+    # Product quantization: vectors are zero-padded to a multiple of the subspace count,
+    # split into equal subvectors, and each subvector is replaced by the index of its
+    # nearest of 256 k-means centroids, i.e. one byte per subspace. A query builds one
+    # subspaces × 256 table of partial dot products (or squared distances) and scores a
+    # code by summing table entries, without decoding anything.
+
+    name = "pq"
+
+    def __init__(self, metric, codebooks, dims):
+        self.metric = metric
+        self.codebooks = codebooks
+        self.dims = dims
+
+    @property
+    def subspaces(self):
+        return len(self.codebooks)
+
+    @property
+    def code_size(self):
+        return self.subspaces
+
+    def _split(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        padded = np.zeros(vectors.shape[:-1] + (self.codebooks.shape[2] * self.subspaces,), dtype=np.float32)
+        padded[..., :self.dims] = vectors
+        return padded.reshape(vectors.shape[:-1] + (self.subspaces, -1))
+
+    @classmethod
+    def train(cls, vectors, metric, subspaces=PQ_SUBSPACES, centroids=PQ_CENTROIDS):
+        dims = vectors.shape[1]
+        subspaces = subspaces or -(-dims // PQ_DIMS)
+        width = -(-dims // subspaces)
+        pq = cls(metric, np.zeros((subspaces, centroids, width), dtype=np.float32), dims)
+
+        # Subvectors of unit vectors aren't unit, so every subspace clusters by Euclidean distance.
+        parts = pq._split(vectors)
+        for j in range(subspaces):
+            trained = kmeans(parts[:, j], centroids, "euclidean", sample=PQ_SAMPLE)
+            pq.codebooks[j, :len(trained)] = trained
+        return pq
+
+    def encode(self, vectors, block=8192):
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        norms = np.einsum("jcw,jcw->jc", self.codebooks, self.codebooks)
+        for start in range(0, len(vectors), block):
+            parts = self._split(vectors[start:start + block])
+            # argmin ‖x - c‖² = argmax 2·x·c - ‖c‖², per subspace.
+            scores = 2.0 * np.einsum("njw,jcw->njc", parts, self.codebooks) - norms
+            codes[start:start + block] = scores.argmax(axis=2)
+        return codes
+
+    def decode(self, codes):
+        parts = self.codebooks[np.arange(self.subspaces), codes]
+        return parts.reshape(len(codes), -1)[:, :self.dims]
+
+    def prepare(self, query):
+        # Per-subspace partial scores of query against every centroid, built once per query.
+        parts = self._split(query)
+        if self.metric == "cosine":
+            return np.einsum("jw,jcw->jc", parts, self.codebooks)
+        return ((self.codebooks - parts[:, None, :]) ** 2).sum(axis=2)
+
+    def distances(self, table, codes):
+        scores = table[np.arange(self.subspaces), codes].sum(axis=1)
+        if self.metric == "cosine":
+            return 1.0 - scores
+        return np.sqrt(np.maximum(scores, 0.0))
+
+    def save(self, path):
+        np.save(os.path.join(path, "pq_codebooks.npy"), self.codebooks)
+
+    @classmethod
+    def load(cls, path, metric, dims):
+        return cls(metric, np.load(os.path.join(path, "pq_codebooks.npy")), dims)
+
+
+QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
@@ -0,0 +1,144 @@
+import logging
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import store
+
+
+class TrackIdRegistry:
+    # Persistent file_path → track_id mapping. generate_track_id only yields a base ID; the
+    # registry checks it against a hash index of every issued ID and appends "-2", "-3", ...
+    # on collision. A path keeps its ID across runs even if its tags (and base ID) change.
+    # IDs of removed files are retired, never reissued: they are saved as rows without a
+    # file_path, so data still keyed by them can't attach to a new file.
+
+    def __init__(self, path):
+        self.path = path
+        self.by_path = {}
+        self.owner = {}
+        self.base_of = {}
+        self.retired = {}
+        self.issued = 0
+        self.collisions = 0
+
+    @classmethod
+    def load(cls, path, seed_rows=()):
+        # Loads the saved mapping. Without one, seeds from an existing metadata table so IDs
+        # that downstream stores already use stay the same.
+        registry = cls(path)
+        if store.table_exists(path):
+            for row in store.read_table(path).itertuples():
+                if pd.isna(row.file_path):
+                    registry._retire(row.track_id, row.base_id)
+                else:
+                    registry._register(row.file_path, row.track_id, row.base_id)
+        else:
+            for row in seed_rows:
+                registry.assign(row["file_path"], row["track_id"])
+            registry.issued = registry.collisions = 0
+        return registry
+
+    def __contains__(self, file_path):
+        return file_path in self.by_path
+
+    def _register(self, file_path, track_id, base_id):
+        self.by_path[file_path] = track_id
+        self.owner[track_id] = file_path
+        self.base_of[file_path] = base_id
+
+    def _retire(self, track_id, base_id):
+        self.owner[track_id] = None
+        self.retired[track_id] = base_id
+
+    def assign(self, file_path, base_id):
+        # Returns the stable ID for file_path, issuing a unique one for paths seen the first time.
+        if file_path in self.by_path:
+            return self.by_path[file_path]
+
+        track_id, n = base_id, 1
+        while track_id in self.owner:
+            n += 1
+            track_id = f"{base_id}-{n}"
+
+        if n > 1:
+            self.collisions += 1
+            logging.warning("track_id collision: %s already taken, %s → %s", base_id, file_path, track_id)
+
+        self._register(file_path, track_id, base_id)
+        self.issued += 1
+        return track_id
+
+    def retain(self, file_paths):
+        # Forgets paths that are no longer in the library; their IDs stay reserved.
+        for file_path in set(self.by_path) - set(file_paths):
+            self._retire(self.by_path.pop(file_path), self.base_of.pop(file_path))
+
+    def save(self):
+        df = pd.DataFrame(
+            [(p, t, self.base_of[p]) for p, t in self.by_path.items()]
+            + [(None, t, base_id) for t, base_id in self.retired.items()],
+            columns=["file_path", "track_id", "base_id"],
+        )
+        store.write_table(df, self.path)
+
+    def log_stats(self):
+        # Base IDs shared by several files show how close generate_track_id is to saturating.
+        shared = Counter(self.base_of.values())
+        colliding = {base: n for base, n in shared.items() if n > 1}
+        logging.info("track_id registry: %d IDs, %d retired, %d issued this run, %d collisions resolved this run",
+                     len(self.by_path), len(self.retired), self.issued, self.collisions)
+        logging.info("track_id registry: %d base IDs shared by %d files (%.2f%%), longest chain %d",
+                     len(colliding), sum(colliding.values()),
+                     100 * sum(colliding.values()) / len(self.by_path) if self.by_path else 0,
+                     max(colliding.values(), default=1))
+
+
+class TrackKeyIndex:
+    # Bidirectional track_id ↔ int32 key index. Keys are dense and append-only: a key is
+    # never reused, so int32 arrays downstream (feature matrix rows, neighbor lists, caches)
+    # keep their meaning across runs. Keys of removed tracks simply stay unused.
+
+    def __init__(self, path):
+        self.path = path
+        self.track_ids = []
+        self.index = pd.Index([], dtype=object)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        keys = cls(path)
+        if store.table_exists(path):
+            df = store.read_table(path).sort_values("key")
+            keys.track_ids = list(df["track_id"])
+            keys.index = pd.Index(keys.track_ids, dtype=object)
+        return keys
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def add(self, track_ids):
+        # Issues keys for track_ids not seen before, in the order given.
+        new = [t for t in dict.fromkeys(track_ids) if t not in self.index]
+        if new:
+            self.track_ids.extend(new)
+            self.index = pd.Index(self.track_ids, dtype=object)
+            self.dirty = True
+
+    def keys(self, track_ids):
+        # int32 keys for track_ids; raises KeyError for unknown tracks.
+        track_ids = list(track_ids)
+        keys = self.index.get_indexer(track_ids)
+        if (keys < 0).any():
+            missing = [t for t, k in zip(track_ids, keys) if k < 0]
+            raise KeyError(f"Unknown track_ids: {missing[:5]}")
+        return keys.astype(np.int32)
+
+    def ids(self, keys):
+        return np.asarray(self.track_ids, dtype=object)[np.asarray(keys)]
+
+    def save(self):
+        df = pd.DataFrame({"key": np.arange(len(self.track_ids), dtype=np.int32), "track_id": self.track_ids})
+        store.write_table(df, self.path)
+        self.dirty = False
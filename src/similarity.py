@@ -0,0 +1,176 @@
+import os
+import glob
+import hashlib
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import store
+from matrix import open_matrix
+from registry import TrackKeyIndex
+from stats import RunningStats
+
+
+OUTPUT_DIR = "Path"
+MATRIX_PATH = os.path.join(OUTPUT_DIR, "lowlevel_matrix")
+KEY_TABLE = store.table_path(OUTPUT_DIR, "track_keys", store.FORMAT)
+
+METRICS = ("cosine", "euclidean")
+# Seeds scored per matrix product; a block's distance matrix is QUERY_BLOCK × tracks float32.
+QUERY_BLOCK = 1024
+# Matrix rows converted at a time while computing the scale and the standardized vectors.
+PREPARE_BLOCK = 65536
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+def column_scale(values, block=PREPARE_BLOCK):
+    # Column means and stds for standardize; constant columns are centered but left unscaled.
+    # Accumulated block by block, so a memory-mapped matrix is never copied whole.
+    stats = RunningStats((values.shape[1],))
+    for start in range(0, len(values), block):
+        stats.update(values[start:start + block])
+    std = stats.std()
+    std[std == 0] = 1.0
+    return stats.mean, std
+
+
+def standardize(values, scale=None, metric=None, out=None, block=PREPARE_BLOCK):
+    # Column-wise z-scores, so features on large scales (centroid in Hz) don't swamp the rest,
+    # and unit-length rows for the cosine metric. A saved scale keeps distances comparable
+    # with ones computed before the catalogue grew. Rows are converted a block at a time into
+    # out (a new float32 array by default).
+    mean, std = column_scale(values) if scale is None else scale
+    out = np.empty(values.shape, dtype=np.float32) if out is None else out
+    for start in range(0, len(values), block):
+        z = (np.asarray(values[start:start + block], dtype=np.float64) - mean) / std
+        if metric == "cosine":
+            norms = np.linalg.norm(z, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            z /= norms
+        out[start:start + block] = z
+    return out
+
+
+def open_vectors(matrix, metric, scale):
+    # The engine's vectors for a matrix opened from disk, memory-mapped read-only from
+    # <path>.<metric>.<matrix version>-<scale digest>.npy. The first process to need them
+    # writes the file; every later engine, worker and query process shares its pages.
+    # Files left from an older version of the matrix are deleted.
+    if matrix.path is None:
+        return standardize(matrix.values, scale, metric)
+
+    stat = os.stat(matrix.path + ".npy")
+    version = hashlib.blake2b(f"{stat.st_size}|{stat.st_mtime_ns}".encode(), digest_size=4).hexdigest()
+    digest = hashlib.blake2b(np.stack(scale).astype(np.float64).tobytes(), digest_size=4).hexdigest()
+    prefix = f"{matrix.path}.{metric}."
+    path = f"{prefix}{version}-{digest}.npy"
+
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=matrix.values.shape)
+        standardize(matrix.values, scale, metric, out)
+        out.flush()
+        del out
+        os.replace(tmp, path)
+
+        for stale in glob.glob(glob.escape(prefix) + "*.npy"):
+            if not os.path.basename(stale).startswith(os.path.basename(prefix) + version):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    return np.load(path, mmap_mode="r")
+
+
+def top_k(d, k):
+    # Column indices and values of the k smallest entries of each row of d, nearest first.
+    # argpartition finds them in linear time; only those k get sorted.
+    top = np.argpartition(d, k - 1, axis=1)[:, :k] if k < d.shape[1] else np.argsort(d, axis=1)[:, :k]
+    top_d = np.take_along_axis(d, top, axis=1)
+    order = np.argsort(top_d, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_d, order, axis=1)
+
+
+class SimilarityEngine:
+    # Exact k-nearest-neighbor search over the standardized feature matrix. Every query is
+    # scored against every track with one matrix product per block of seeds, so this is the
+    # reference that approximate indexes are checked against.
+
+    def __init__(self, matrix, keys, metric="cosine", scale=None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric} (expected one of {METRICS})")
+        self.matrix = matrix
+        self.keys = keys
+        self.metric = metric
+
+        self.scale = column_scale(matrix.values) if scale is None else scale
+        self.vectors = open_vectors(matrix, metric, self.scale)
+        if metric == "euclidean":
+            self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+
+    @classmethod
+    def load(cls, matrix_path=MATRIX_PATH, key_table=KEY_TABLE, metric="cosine", scale=None):
+        return cls(open_matrix(matrix_path), TrackKeyIndex.load(key_table), metric, scale)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def rows(self, track_ids):
+        return self.matrix.rows(self.keys.keys(track_ids))
+
+    def distances(self, rows, targets=slice(None)):
+        # Seeds × targets distance block (all tracks by default): 1 - cosine similarity, or
+        # Euclidean distance.
+        products = self.vectors[rows] @ self.vectors[targets].T
+        if self.metric == "cosine":
+            return 1.0 - products
+        squared = self.sq_norms[rows, None] + self.sq_norms[None, targets] - 2.0 * products
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def search(self, rows, k=10, block=QUERY_BLOCK):
+        # Top-k matrix rows and distances for each seed row, nearest first, seeds excluded.
+        rows = np.asarray(rows, dtype=np.int64)
+        k = min(k, len(self) - 1)
+        neighbors = np.empty((len(rows), k), dtype=np.int64)
+        distances = np.empty((len(rows), k), dtype=np.float32)
+
+        for start in range(0, len(rows), block):
+            seeds = rows[start:start + block]
+            d = self.distances(seeds)
+            d[np.arange(len(seeds)), seeds] = np.inf
+
+            neighbors[start:start + len(seeds)], distances[start:start + len(seeds)] = top_k(d, k)
+
+        return neighbors, distances
+
+    def query_many(self, track_ids, k=10, block=QUERY_BLOCK):
+        # Neighbors of many seeds at once as a long table: seed, rank, track_id, distance.
+        track_ids = list(track_ids)
+        neighbors, distances = self.search(self.rows(track_ids), k, block)
+        n, k = neighbors.shape
+        return pd.DataFrame({
+            "seed": np.repeat(np.asarray(track_ids, dtype=object), k),
+            "rank": np.tile(np.arange(1, k + 1), n),
+            "track_id": self.keys.ids(self.matrix.keys[neighbors.ravel()]),
+            "distance": distances.ravel(),
+        })
+
+    def query(self, track_id, k=10):
+        # Nearest tracks to a single seed as (track_id, distance) pairs.
+        df = self.query_many([track_id], k)
+        return list(zip(df["track_id"], df["distance"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nearest tracks by low-level audio features")
+    parser.add_argument("track_ids", nargs="+")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--metric", choices=METRICS, default="cosine")
+    args = parser.parse_args()
+
+    engine = SimilarityEngine.load(metric=args.metric)
+    print(engine.query_many(args.track_ids, args.k).to_string(index=False))
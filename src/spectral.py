@@ -0,0 +1,98 @@
+import numpy as np
+
+
+# NumPy counterparts of the Essentia algorithms used by lowlevel.py, configured with the
+# same defaults (Windowing hann, Spectrum, MFCC, Centroid, Flatness) so they can run over
+# a whole block of frames in one call.
+
+
+def frame_count(n, frame_size, hop_size):
+    # Matches FrameGenerator(startFromZero=True): frames start every hop while their centre
+    # is inside the signal, and a non-empty signal always yields at least one frame.
+    if n == 0:
+        return 0
+    return max(1, -(-(n - frame_size // 2) // hop_size))
+
+
+def frame_signal(audio, frame_size, hop_size):
+    # Zero-pads the tail and returns a read-only strided (frames, frame_size) view.
+    count = frame_count(len(audio), frame_size, hop_size)
+    if count == 0:
+        return np.empty((0, frame_size), dtype=audio.dtype)
+
+    padded = np.zeros((count - 1) * hop_size + frame_size, dtype=audio.dtype)
+    used = min(len(audio), len(padded))
+    padded[:used] = audio[:used]
+    return np.lib.stride_tricks.sliding_window_view(padded, frame_size)[::hop_size]
+
+
+def hann_window(size):
+    # Symmetric Hann window normalized to unit area times two, like Windowing(normalized=True).
+    window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(size) / (size - 1))
+    return window * (2 / window.sum())
+
+
+def hz_to_mel(f):
+    return 2595 * np.log10(1 + f / 700)
+
+
+def mel_filterbank(input_size, sample_rate=44100, number_bands=40, low=0.0, high=11000.0):
+    # Triangular filters in the HTK mel domain with unit-sum normalization (MelBands defaults).
+    edges = np.linspace(hz_to_mel(low), hz_to_mel(high), number_bands + 2)
+    bins = hz_to_mel(np.arange(input_size) * (sample_rate / 2) / (input_size - 1))
+
+    lo, centre, hi = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    filters = np.maximum(0, np.minimum((bins - lo) / (centre - lo), (hi - bins) / (hi - centre)))
+    return filters / filters.sum(axis=1, keepdims=True)
+
+
+def dct_matrix(number_coefficients, number_bands):
+    # Orthonormal DCT-II rows, as used by MFCC(dctType=2).
+    k = np.arange(number_coefficients)[:, None]
+    j = np.arange(number_bands)[None, :]
+    dct = np.sqrt(2 / number_bands) * np.cos(np.pi * k * (2 * j + 1) / (2 * number_bands))
+    dct[0] /= np.sqrt(2)
+    return dct
+
+
+class SpectralEngine:
+    # Batched window → spectrum → MFCC/centroid/flatness over (frames, frame_size) arrays.
+
+    def __init__(self, frame_size, sample_rate=44100, number_coefficients=13, silence_threshold=1e-10):
+        bins = frame_size // 2 + 1
+        self.window = hann_window(frame_size).astype(np.float32)
+        self.mel = mel_filterbank(bins, sample_rate).T
+        self.dct = dct_matrix(number_coefficients, self.mel.shape[1]).T
+        self.bin_index = np.arange(bins) / (bins - 1)
+        self.silence_threshold = silence_threshold
+
+    def windowed(self, frames):
+        return frames * self.window
+
+    def magnitude(self, windowed):
+        return np.abs(np.fft.rfft(windowed, axis=1))
+
+    def spectrum(self, frames):
+        return self.magnitude(self.windowed(frames))
+
+    def mfcc(self, spectra):
+        bands = (spectra.astype(np.float64) ** 2) @ self.mel
+        return (20 * np.log10(np.maximum(bands, self.silence_threshold))) @ self.dct
+
+    def centroid(self, spectra):
+        total = spectra.sum(axis=1, dtype=np.float64)
+        weighted = spectra @ self.bin_index
+        return np.divide(weighted, total, out=np.zeros_like(total), where=total > 0)
+
+    def flatness(self, spectra):
+        # Geometric over arithmetic mean; Essentia returns 0 once any bin is exactly zero.
+        spectra = spectra.astype(np.float64)
+        valid = spectra.min(axis=1) > 0
+        safe = np.where(valid[:, None], spectra, 1.0)
+        flatness = np.exp(np.log(safe).mean(axis=1)) / safe.mean(axis=1)
+        return np.where(valid, flatness, 0.0)
+
+    def flux(self, spectra, previous):
+        # Squared difference to the previous spectrum; previous carries across blocks.
+        stacked = np.vstack([previous[None, :], spectra]).astype(np.float64)
+        return np.sum(np.diff(stacked, axis=0) ** 2, axis=1)
@@ -0,0 +1,33 @@
+import numpy as np
+
+
+class RunningStats:
+    # Running mean and population std (np.std's ddof=0) over scalars or fixed-size vectors.
+    # Blocks are merged with Chan's parallel form of Welford's update, so memory stays
+    # constant no matter how many observations are seen.
+
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, values):
+        # Adds a block of observations stacked along the first axis.
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return
+
+        block_mean = values.mean(axis=0)
+        block_m2 = ((values - block_mean) ** 2).sum(axis=0)
+
+        total = self.count + n
+        delta = block_mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + block_m2 + delta ** 2 * (self.count * n / total)
+        self.count = total
+
+    def std(self):
+        if not self.count:
+            return np.zeros_like(self.m2)
+        return np.sqrt(self.m2 / self.count)
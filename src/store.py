@@ -0,0 +1,209 @@
+import os
+import shutil
+import logging
+import argparse
+import operator
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+
+# Feature tables keyed by track_id. Parquet and Arrow IPC tables are directories of part
+# files, so checkpointed runs can append a batch without rewriting what is already there;
+# CSV stays available for export and for the notebook.
+FORMAT = "parquet"
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+COMPRESSION = "zstd"
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+FILTER_OPS = {
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda column, values: column.isin(values),
+    "not in": lambda column, values: ~column.isin(values),
+}
+
+
+def table_path(directory, name, fmt=FORMAT):
+    return os.path.join(directory, name + EXTENSIONS[fmt])
+
+
+def table_format(path):
+    ext = os.path.splitext(path)[1]
+    for fmt, fmt_ext in EXTENSIONS.items():
+        if ext == fmt_ext:
+            return fmt
+    raise ValueError(f"Unknown table format: {path}")
+
+
+def table_exists(path):
+    # A table swap interrupted after the old copy was moved aside is rolled back first.
+    if not os.path.exists(path) and os.path.exists(path + ".old"):
+        os.replace(path + ".old", path)
+    return os.path.exists(path)
+
+
+def find_table(directory, name):
+    # Returns the existing table for name, preferring columnar formats over CSV.
+    for fmt in ("parquet", "arrow", "csv"):
+        path = table_path(directory, name, fmt)
+        if table_exists(path):
+            return path
+    return None
+
+
+def remove_table(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _write_part(df, path, fmt):
+    # Parts are written under an underscore name, which dataset readers skip, and renamed
+    # into place, so a crash never leaves a torn part behind.
+    os.makedirs(path, exist_ok=True)
+    parts = [f for f in os.listdir(path) if f.endswith(EXTENSIONS[fmt])]
+    name = f"part-{len(parts):05d}{EXTENSIONS[fmt]}"
+    tmp = os.path.join(path, "_" + name)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if fmt == "parquet":
+        pq.write_table(table, tmp, compression=COMPRESSION)
+    else:
+        feather.write_feather(table, tmp, compression=COMPRESSION)
+    os.replace(tmp, os.path.join(path, name))
+
+
+def append_table(df, path):
+    # Appends rows; the CSV header is only written when the file is new.
+    fmt = table_format(path)
+    if fmt == "csv":
+        df.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+    else:
+        _write_part(df, path, fmt)
+
+
+def swap_in(tmp, path):
+    # Moves tmp to path, replacing what is there. Files are replaced atomically; a directory
+    # can't be renamed over, so the old one is moved aside first and deleted only once the
+    # new one is in place. A crash in between leaves path + ".old", which table_exists restores.
+    old = path + ".old"
+    # Left by an earlier interrupted swap; tmp supersedes it.
+    remove_table(old)
+    if not os.path.isdir(path):
+        os.replace(tmp, path)
+        return
+
+    os.replace(path, old)
+    os.replace(tmp, path)
+    remove_table(old)
+
+
+@contextmanager
+def replacing_dir(path):
+    # Yields an empty directory to build a new copy of path in, swapped in on success like
+    # write_table; an error leaves path untouched.
+    tmp = path + ".tmp"
+    remove_table(tmp)
+    os.makedirs(tmp)
+    yield tmp
+    swap_in(tmp, path)
+
+
+def write_table(df, path):
+    # Replaces the whole table. The new copy is built beside the old one and swapped in.
+    fmt = table_format(path)
+    tmp = path + ".tmp"
+    remove_table(tmp)
+
+    if fmt == "csv":
+        df.to_csv(tmp, index=False)
+    else:
+        _write_part(df, tmp, fmt)
+
+    swap_in(tmp, path)
+
+
+def _disjunction(filters):
+    # pyarrow-style DNF: a list of (column, op, value) tuples is ANDed, a list of such lists is ORed.
+    return [filters] if isinstance(filters[0], tuple) else filters
+
+
+def _filter_frame(df, filters):
+    mask = pd.Series(False, index=df.index)
+    for conjunction in _disjunction(filters):
+        clause = pd.Series(True, index=df.index)
+        for column, op, value in conjunction:
+            clause &= FILTER_OPS[op](df[column], value)
+        mask |= clause
+    return df[mask]
+
+
+def read_table(path, columns=None, filters=None):
+    # Loads a table with optional column projection and row filters. Columnar formats push
+    # both down to the reader; CSV is parsed and then filtered in memory.
+    fmt = table_format(path)
+
+    if fmt == "csv":
+        usecols = None
+        if columns is not None:
+            wanted = set(columns)
+            for conjunction in _disjunction(filters) if filters else []:
+                wanted.update(column for column, _, _ in conjunction)
+            usecols = list(wanted)
+
+        df = pd.read_csv(path, usecols=usecols, float_precision="round_trip")
+        if filters:
+            df = _filter_frame(df, filters).reset_index(drop=True)
+        return df[columns] if columns is not None else df
+
+    dataset = ds.dataset(path, format="parquet" if fmt == "parquet" else "ipc")
+    expression = pq.filters_to_expression(filters) if filters else None
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def load_metadata(directory):
+    # The metadata table every extraction stage runs from.
+    df = read_table(find_table(directory, "metadata"))
+    logging.info("Loaded metadata: %d tracks", len(df))
+    return df
+
+
+def in_metadata_order(df, metadata_df):
+    # A stage table's rows, appended in completion order, sorted like the metadata.
+    order = {track_id: i for i, track_id in enumerate(metadata_df['track_id'])}
+    return df.sort_values('track_id', key=lambda ids: ids.map(order), kind='stable')
+
+
+def convert_table(src, dst):
+    # Rewrites a table in another format, e.g. lowlevel.csv → lowlevel.parquet or back.
+    df = read_table(src)
+    write_table(df, dst)
+    logging.info("Converted %d rows: %s → %s", len(df), src, dst)
+
+
+def table_size(path):
+    # Bytes on disk, summed over part files for columnar tables.
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Synch feature tables between formats")
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    args = parser.parse_args()
+    convert_table(args.src, args.dst)